@@ -34,6 +34,8 @@ from game import Actions
 from game import Configuration
 from util import nearestPoint
 from util import manhattanDistance
+from collections import deque
+import numpy as np
 import sys, util, types, time, random, layout, os
 
 ########################################
@@ -52,21 +54,119 @@ def getNoisyDistance(pos1, pos2):
     # return max(0, distance + util.sample(SONAR_NOISE_PROBS, SONAR_NOISE_VALUES))
     return distance
 
-observationDistributions = {}
+# Stands for the distance to a ghost without a reading (captured or in jail)
+NO_GHOST_DISTANCE = 99999
+
+def findNearestGhost(ghostDistances):
+    """
+    Returns the index and distance of the first ghost with the smallest
+    reading, or (None, NO_GHOST_DISTANCE) if no ghost has one.
+    """
+    nearestIdx, nearestDistance = None, NO_GHOST_DISTANCE
+    for idx, distance in enumerate(ghostDistances):
+        if distance is not None and distance < nearestDistance:
+            nearestIdx, nearestDistance = idx, distance
+    return nearestIdx, nearestDistance
+
+# Codes of getDirectionToNearestGhost
+NEAREST_GHOST_DIRECTIONS = {
+    "N": 1,
+    "E": 2,
+    "S": 3,
+    "W": 4
+}
+
+observationMatrix = None
+def getObservationMatrix(size):
+    """
+    Returns the emission table P( noisyDistance | trueDistance ) as a read-only
+    array indexed by [noisyDistance, trueDistance], covering (at least) every
+    distance below size.  The table is built from SONAR_NOISE_PROBS once and
+    rebuilt, twice as large, only when a larger size is asked for.
+    """
+    global observationMatrix
+    if observationMatrix is None or len(observationMatrix) < size:
+        n = 64 if observationMatrix is None else len(observationMatrix)
+        while n < size: n *= 2
+        matrix = np.zeros((n, n))
+        noisyDistances = np.arange(n)
+        for error, prob in zip(SONAR_NOISE_VALUES, SONAR_NOISE_PROBS):
+            trueDistances = np.maximum(1, noisyDistances - error)
+            inRange = trueDistances < n
+            matrix[noisyDistances[inRange], trueDistances[inRange]] += prob
+        matrix.flags.writeable = False
+        observationMatrix = matrix
+    return observationMatrix
+
 def getObservationDistribution(noisyDistance):
     """
     Returns the factor P( noisyDistance | TrueDistances ), the likelihood of the provided noisyDistance
     conditioned upon all the possible true distances that could have generated it.
+
+    This is a row of getObservationMatrix as a Counter, for code that wants
+    one; inference loops should index the matrix instead.
     """
-    global observationDistributions
     if noisyDistance == None:
-        return util.Counter()
-    if noisyDistance not in observationDistributions:
-        distribution = util.Counter()
-        for error , prob in zip(SONAR_NOISE_VALUES, SONAR_NOISE_PROBS):
-            distribution[max(1, noisyDistance - error)] += prob
-        observationDistributions[noisyDistance] = distribution
-    return observationDistributions[noisyDistance]
+        return util.FastCounter()
+    row = getObservationMatrix(noisyDistance + SONAR_MAX + 1)[noisyDistance]
+    distribution = util.FastCounter()
+    for trueDistance in np.flatnonzero(row):
+        distribution[int(trueDistance)] = float(row[trueDistance])
+    return distribution
+
+class FoodIndex(object):
+    """
+    Distances from every cell to the nearest food of one food grid.
+
+    A FoodIndex belongs to one arrangement of the food: states share it
+    until some food is eaten, when checkFoodEaten gives the successor a new
+    one.  Each distance field is a multi-source BFS from all the food,
+    computed the first time it is asked for, so queries are O(1) and the
+    fields are only rebuilt for arrangements that are actually queried.
+    The Manhattan field ignores the walls and the maze field goes around
+    them.
+    """
+    def __init__(self, food, walls):
+        self.food = food
+        self.walls = walls
+        self.numFood = food.count()
+        self.manhattanField = None
+        self.mazeField = None
+
+    def getManhattanDistance(self, position):
+        "Manhattan distance from position to the nearest food, or None if there is none"
+        if self.numFood == 0: return None
+        if self.manhattanField is None:
+            self.manhattanField = self.computeField(False)
+        x, y = position
+        return self.manhattanField[x * self.food.height + y]
+
+    def getMazeDistance(self, position):
+        "Maze distance from position to the nearest reachable food, or None"
+        if self.numFood == 0: return None
+        if self.mazeField is None:
+            self.mazeField = self.computeField(True)
+        x, y = position
+        return self.mazeField[x * self.food.height + y]
+
+    def computeField(self, avoidWalls):
+        width, height = self.food.width, self.food.height
+        field = [None] * (width * height)
+        fringe = deque()
+        for x, y in self.food.asList():
+            field[x * height + y] = 0
+            fringe.append((x, y))
+        walls = self.walls
+        while fringe:
+            x, y = fringe.popleft()
+            distance = field[x * height + y] + 1
+            for nextX, nextY in ((x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)):
+                if not (0 <= nextX < width and 0 <= nextY < height): continue
+                cell = nextX * height + nextY
+                if field[cell] is not None or (avoidWalls and walls[nextX][nextY]): continue
+                field[cell] = distance
+                fringe.append((nextX, nextY))
+        return field
 
 ###################################################
 # YOUR INTERFACE TO THE PACMAN WORLD: A GameState #
@@ -125,7 +225,7 @@ class GameState(object):
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
         else:
-            GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+            GhostRules.decrementTimer( state.data.getWritableAgentState(agentIndex) )
 
         # Resolve multi-agent effects
         GhostRules.checkDeath( state, agentIndex )
@@ -137,7 +237,14 @@ class GameState(object):
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
         p = state.getPacmanPosition()
-        state.data.ghostDistances = [getNoisyDistance(p, state.getGhostPosition(i)) for i in range(1,state.getNumAgents())]
+        if agentIndex == 0:
+            state.data.ghostDistances = [getNoisyDistance(p, state.getGhostPosition(i)) for i in range(1,state.getNumAgents())]
+            state.nearestGhost = findNearestGhost(state.data.ghostDistances)
+        else:
+            # Only this ghost's reading can have changed
+            state.data.ghostDistances = self.data.ghostDistances[:]
+            state.data.ghostDistances[agentIndex - 1] = getNoisyDistance(p, state.getGhostPosition(agentIndex))
+            state.nearestGhost = self.updateNearestGhost(state.data.ghostDistances, agentIndex - 1)
         state.ghostPositions = self.ghostPositions = [self.getGhostPosition(i) for i in range(1, self.getNumAgents())]
         a = 0
         for i in range(1, self.getNumAgents()):
@@ -229,20 +336,14 @@ class GameState(object):
         """
         Returns the distance to the nearest food
         """
-        if(self.getNumFood() > 0):
-            minDistance = 900000
-            pacmanPosition = self.getPacmanPosition()
-            for i in range(self.data.layout.width):
-                for j in range(self.data.layout.height):
-                    if self.hasFood(i, j):
-                        foodPosition = i, j
-                        distance = util.manhattanDistance(pacmanPosition, foodPosition)
-                        if distance < minDistance:
-                            minDistance = distance
-            return minDistance
+        return self.foodIndex.getManhattanDistance(self.getPacmanPosition())
 
-        else:
-            return None;
+    def getMazeDistanceNearestFood(self):
+        """
+        Returns the distance to the nearest food going around the walls, or
+        None if no food can be reached
+        """
+        return self.foodIndex.getMazeDistance(self.getPacmanPosition())
 
     def getGhostPositions(self):
         return self.ghostPositions
@@ -268,34 +369,37 @@ class GameState(object):
         """
         return self.data.ghostDistances
 
-    def getIdxNearestGhost(self):
-        # ghostsDistances = [d for d in self.data.ghostDistances if d is not None]
-        newDistances = [d for d in self.data.ghostDistances]
-        for i in range(len(newDistances)):
-            if newDistances[i] is None:
-                newDistances[i] = 99999
-        nearestGhost = min(newDistances)
+    def updateNearestGhost(self, ghostDistances, movedIdx):
+        """
+        Returns the nearest ghost of a successor in which only ghost movedIdx
+        has a new reading, starting from this state's nearest ghost.
+        """
+        nearestIdx, nearestDistance = self.nearestGhost
+        distance = ghostDistances[movedIdx]
+        if movedIdx == nearestIdx:
+            # Still the nearest unless it went away
+            if distance is not None and distance <= nearestDistance:
+                return movedIdx, distance
+            return findNearestGhost(ghostDistances)
+        if distance is not None and (distance < nearestDistance or (distance == nearestDistance and movedIdx < nearestIdx)):
+            return movedIdx, distance
+        return nearestIdx, nearestDistance
 
-        return self.data.ghostDistances.index(nearestGhost)
+    def getIdxNearestGhost(self):
+        nearestIdx = self.nearestGhost[0]
+        if nearestIdx is None:
+            raise ValueError("No ghost has a distance reading")
+        return nearestIdx
 
     ##### Our Own Implementation for Nearest Ghost #
     def getDistanceNearestGhost(self, idx=None):
-        # get the position of the nearest ghost
-        # (we check that it is not None to avoid picking the distance to foods)
-        newDistances = [d for d in self.data.ghostDistances]
-        for i in range(len(newDistances)):
-            if newDistances[i] is None:
-                newDistances[i] = 99999
-        # ghostsDistances = [d for d in self.data.ghostDistances if d is not None]
-        # print(ghostsDistances)
-
+        # Ghosts without a reading are NO_GHOST_DISTANCE away
         if idx is None:
-            # if ghostsDistances:
-            return min(newDistances)
-        else:
-            return newDistances[idx]
-
-        # return 0
+            return self.nearestGhost[1]
+        distance = self.data.ghostDistances[idx]
+        if distance is None:
+            return NO_GHOST_DISTANCE
+        return distance
     
     def getDirectionToNearestGhost(self, idx=None):
         # directions = {
@@ -308,13 +412,15 @@ class GameState(object):
         #     "SE": 7, # South-East
         #     "EE": 8  # East
         # }
-        directions = {
-            "N": 1,
-            "E": 2,
-            "S": 3,
-            "W": 4
-        }
-        ghostIdx = self.data.ghostDistances.index(self.getDistanceNearestGhost(idx))
+        if idx is None:
+            # Worked out once per state
+            if self.nearestGhostDirection is None:
+                self.nearestGhostDirection = self.computeDirectionToGhost(self.getIdxNearestGhost())
+            return self.nearestGhostDirection
+        return self.computeDirectionToGhost(self.data.ghostDistances.index(self.getDistanceNearestGhost(idx)))
+
+    def computeDirectionToGhost(self, ghostIdx):
+        directions = NEAREST_GHOST_DIRECTIONS
         ghostPosition = self.getGhostPosition(ghostIdx + 1)
         pacmanPosition = self.getPacmanPosition()
 
@@ -366,6 +472,9 @@ class GameState(object):
             self.data = GameStateData(prevState.data)
             self.livingGhosts = prevState.livingGhosts[:]
             self.ghostPositions = prevState.ghostPositions[:]
+            self.nearestGhost = prevState.nearestGhost
+            self.nearestGhostDirection = None
+            self.foodIndex = prevState.foodIndex
             self.numMoves = prevState.numMoves;
             self.maxMoves = prevState.maxMoves;
         else: # Initial state
@@ -373,11 +482,15 @@ class GameState(object):
             self.numMoves = 0;
             self.maxMoves = -1;
             self.data.ghostDistances = []
+            self.nearestGhost = findNearestGhost(self.data.ghostDistances)
+            self.nearestGhostDirection = None
+            self.foodIndex = None
 
     def deepCopy( self ):
         state = GameState( self )
         state.data = self.data.deepCopy()
         state.data.ghostDistances = self.data.ghostDistances
+        state.nearestGhostDirection = self.nearestGhostDirection
         return state
 
     def __eq__( self, other ):
@@ -403,8 +516,10 @@ class GameState(object):
         Creates an initial game state from a layout array (see layout.py).
         """
         self.data.initialize(layout, numGhostAgents)
+        self.foodIndex = FoodIndex(self.data.food, layout.walls)
         self.livingGhosts = [False] + [True for i in range(numGhostAgents)]
         self.data.ghostDistances = [getNoisyDistance(self.getPacmanPosition(), self.getGhostPosition(i)) for i in range(1, self.getNumAgents())]
+        self.nearestGhost = findNearestGhost(self.data.ghostDistances)
         self.ghostPositions = [self.getGhostPosition(i) for i in range(1, self.getNumAgents())]
 
     def getGhostPosition( self, agentIndex ):
@@ -468,7 +583,7 @@ class PacmanRules(object):
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+        return Actions.getPossibleActions( state.data.agentStates[0].configuration, state.data.layout.walls )
     getLegalActions = staticmethod( getLegalActions )
 
     def applyAction( state, action ):
@@ -479,7 +594,7 @@ class PacmanRules(object):
         if action not in legal:
             raise Exception("Illegal action", action)
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.getWritableAgentState(0)
 
         # Update Configuration
         vector = Actions.directionToVector( action, 1)
@@ -501,7 +616,7 @@ class GhostRules(object):
         if action not in legal and action != Directions.STOP:
             raise Exception("Illegal ghost action: " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.getWritableAgentState(ghostIndex)
         vector = Actions.directionToVector( action, 1 )
         ghostState.configuration = ghostState.configuration.generateSuccessor( vector )
     applyAction = staticmethod( applyAction )
@@ -509,7 +624,9 @@ class GhostRules(object):
     def decrementTimer( ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint( ghostState.configuration.pos )
+            # Configurations are shared between states, so replace it
+            configuration = ghostState.configuration
+            ghostState.configuration = Configuration( nearestPoint( configuration.pos ), configuration.direction )
         ghostState.scaredTimer = max( 0, timer - 1 )
     decrementTimer = staticmethod( decrementTimer )
 
@@ -533,15 +650,19 @@ class GhostRules(object):
         if agentIndex == 0: # Pacman just moved; Anyone can kill him
             if state.hasFood(pacmanPosition[0], pacmanPosition[1]):
                 state.data._foodEaten = pacmanPosition[0], pacmanPosition[1]
+                state.data.food = state.data.food.copy()
                 state.data.food[pacmanPosition[0]][pacmanPosition[1]] = False
+                state.foodIndex = FoodIndex(state.data.food, state.data.layout.walls)
                 state.data.scoreChange += 100
     checkFoodEaten = staticmethod( checkFoodEaten )
 
 
     def collide( state, ghostState, agentIndex):
         state.data.scoreChange += 200
+        ghostState = state.data.getWritableAgentState(agentIndex)
         GhostRules.placeGhost(ghostState, agentIndex)
         # Added for first-person
+        state.data._eaten = state.data._eaten[:]
         state.data._eaten[agentIndex] = True
         state.setGhostNotLiving(agentIndex)
     collide = staticmethod( collide )
@@ -624,6 +745,8 @@ def readCommand( argv ):
                       help='Renders the ghosts in the display (cheating)', default=True)
     parser.add_option('-t', '--frameTime', dest='frameTime', type='float',
                       help=default('Time to delay between frames; <0 means keyboard'), default=0.1)
+    parser.add_option('--workers', dest='workers', type='int',
+                      help=default('Number of processes playing the games without graphics, sharing one Q-table'), default=1)
 
     options, otherjunk = parser.parse_args()
     if len(otherjunk) != 0:
@@ -653,6 +776,7 @@ def readCommand( argv ):
                                                                   options.showGhosts, \
                                                                   frameTime = options.frameTime)
     args['numGames'] = options.numGames
+    args['workers'] = options.workers
 
     return args
 
@@ -679,7 +803,7 @@ def loadAgent(pacman, nographics):
                 return getattr(module, pacman)
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
-def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1):
+def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1, workers=1):
     # Hack for agents writing to the display
     import __main__
     __main__.__dict__['_display'] = display
@@ -687,14 +811,26 @@ def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1):
     rules = BustersGameRules()
     games = []
 
-    for i in range( numGames ):
-        game = rules.newGame( layout, pacman, ghosts, display, maxMoves )
-        game.run()
-        games.append(game)
+    if workers > 1:
+        # Training run: the games are played headless by parallel workers
+        import parallelTraining, bustersAgents
+        results = parallelTraining.runGamesInWorkers(runGames, workers, numGames, pacman, layout=layout,
+                                                     ghosts=ghosts, display=bustersAgents.NullGraphics(),
+                                                     maxMoves=maxMoves)
+    else:
+        for i in range( numGames ):
+            game = rules.newGame( layout, pacman, ghosts, display, maxMoves )
+            game.run()
+            games.append(game)
+        results = [(game.state.getScore(), game.state.isWin()) for game in games]
+
+    # Learning agents write their qtable out once the games are over
+    if hasattr(pacman, 'writeQtable'):
+        pacman.writeQtable()
 
     if numGames > 1:
-        scores = [game.state.getScore() for game in games]
-        wins = [game.state.isWin() for game in games]
+        scores = [score for score, win in results]
+        wins = [win for score, win in results]
         winRate = wins.count(True)/ float(len(wins))
         print('Average Score:', sum(scores) / float(len(scores)))
         print('Scores:       ', ', '.join([str(score) for score in scores]))
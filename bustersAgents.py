@@ -26,6 +26,8 @@ import random
 
 class NullGraphics(object):
     "Placeholder for graphics"
+    # Game.run skips the updates of null displays
+    NULL_DISPLAY = True
     def initialize(self, state, isBlue = False):
         pass
     def update(self, state):
@@ -45,19 +47,20 @@ class KeyboardInference(inference.InferenceModule):
     """
     def initializeUniformly(self, gameState):
         "Begin with a uniform distribution over ghost positions."
-        self.beliefs = util.Counter()
+        self.beliefs = util.FastCounter()
         for p in self.legalPositions: self.beliefs[p] = 1.0
         self.beliefs.normalize()
 
     def observe(self, observation, gameState):
         noisyDistance = observation
-        emissionModel = busters.getObservationDistribution(noisyDistance)
         pacmanPosition = gameState.getPacmanPosition()
-        allPossible = util.Counter()
-        for p in self.legalPositions:
-            trueDistance = util.manhattanDistance(p, pacmanPosition)
-            if emissionModel[trueDistance] > 0:
-                allPossible[p] = 1.0
+        allPossible = util.FastCounter()
+        if noisyDistance is not None:
+            trueDistances = [util.manhattanDistance(p, pacmanPosition) for p in self.legalPositions]
+            emissionModel = busters.getObservationMatrix(max(trueDistances + [noisyDistance]) + 1)[noisyDistance]
+            for p, trueDistance in zip(self.legalPositions, trueDistances):
+                if emissionModel[trueDistance] > 0:
+                    allPossible[p] = 1.0
         allPossible.normalize()
         self.beliefs = allPossible
 
@@ -71,9 +74,15 @@ class KeyboardInference(inference.InferenceModule):
 class BustersAgent(object):
     "An agent that tracks and displays its beliefs about ghost positions."
 
-    def __init__( self, index = 0, inference = "ExactInference", ghostAgents = None, observeEnable = True, elapseTimeEnable = True):
+    def __init__( self, index = 0, inference = "ExactInference", ghostAgents = None, observeEnable = True, elapseTimeEnable = True, numParticles = None):
         inferenceType = util.lookup(inference, globals())
         self.inferenceModules = [inferenceType(a) for a in ghostAgents]
+        # The particle budget of ParticleFilter and MarginalInference; exact
+        # inference has none
+        if numParticles is not None:
+            for module in self.inferenceModules:
+                if hasattr(module, 'setNumParticles'):
+                    module.setNumParticles(int(numParticles))
         self.observeEnable = observeEnable
         self.elapseTimeEnable = elapseTimeEnable
         
@@ -0,0 +1,122 @@
+# bustersEnv.py
+# -------------
+
+"""
+A headless, vectorized interface to the busters game for training.
+
+VecBustersEnv steps K independent busters games at once:
+
+  env = VecBustersEnv(layout.getLayout('oneHunt'), ghosts, numEnvs=8, maxMoves=300)
+  observations = env.reset()
+  while training:
+      actions = chooseActions(observations, env.legalMasks())
+      observations, rewards, dones = env.step(actions)
+
+Each call to step moves Pacman in every game, then every ghost of the games
+that are not over, exactly as Game.run would for one round.  Unlike
+Game.run there is no display, no output muting, no timeouts and no copies
+of the state handed to the agents, so the ghost agents must not modify the
+states they are given (none of the ones in this project do).
+
+Actions are the indices of ACTIONS, which is also the column order of the
+PacmanQAgent's Q-table, or the direction names themselves.  The reward of a
+step is the change of the game score, as seen by ReinforcementAgent.  A game
+that ends is restarted straight away; its last state is left in
+env.finalStates until the next step.
+"""
+
+import numpy as np
+import busters
+from game import Directions
+
+ACTIONS = [Directions.NORTH, Directions.EAST, Directions.SOUTH, Directions.WEST, Directions.STOP]
+ACTION_INDEX = dict((action, index) for index, action in enumerate(ACTIONS))
+
+def bustersObservation(state):
+    """
+    The default observation of a busters state: Pacman's position, then the
+    offset from Pacman to each ghost, the noisy distance to each ghost (-1
+    once it is captured) and whether each ghost is still alive.
+    """
+    x, y = state.getPacmanPosition()
+    observation = [x, y]
+    for ghostX, ghostY in state.getGhostPositions():
+        observation.append(ghostX - x)
+        observation.append(ghostY - y)
+    for distance in state.getNoisyGhostDistances():
+        observation.append(-1 if distance is None else distance)
+    observation.extend(state.getLivingGhosts()[1:])
+    return observation
+
+class VecBustersEnv(object):
+    """
+    K busters games on the same layout, stepped together.  The ghost agents
+    are shared by all the games.
+    """
+    def __init__(self, layout, ghostAgents, numEnvs=1, maxMoves=-1, observe=bustersObservation):
+        self.layout = layout
+        self.ghostAgents = list(ghostAgents)
+        self.numEnvs = numEnvs
+        self.maxMoves = maxMoves
+        self.observe = observe
+        self.states = [None] * numEnvs
+        self.finalStates = [None] * numEnvs
+        self.episodes = 0
+
+    def newState(self):
+        state = busters.GameState()
+        state.initialize(self.layout, len(self.ghostAgents))
+        state.maxMoves = self.maxMoves
+        return state
+
+    def reset(self):
+        "Starts a new game in every environment and returns their observations"
+        self.states = [self.newState() for i in range(self.numEnvs)]
+        self.finalStates = [None] * self.numEnvs
+        return self.observations()
+
+    def observations(self):
+        return np.array([self.observe(state) for state in self.states], dtype=float)
+
+    def legalMasks(self):
+        "Returns a (numEnvs x len(ACTIONS)) boolean array of Pacman's legal actions"
+        masks = np.zeros((self.numEnvs, len(ACTIONS)), dtype=bool)
+        for i, state in enumerate(self.states):
+            for action in state.getLegalActions(0):
+                masks[i, ACTION_INDEX[action]] = True
+        return masks
+
+    def step(self, actions):
+        """
+        Plays one round in every game: actions[i] is Pacman's move in game i.
+        Returns the observations, rewards and done flags as arrays.
+        """
+        if len(actions) != self.numEnvs:
+            raise Exception("Expected %d actions, got %d" % (self.numEnvs, len(actions)))
+        rewards = np.zeros(self.numEnvs)
+        dones = np.zeros(self.numEnvs, dtype=bool)
+        for i, action in enumerate(actions):
+            state = self.states[i]
+            if not isinstance(action, str):
+                action = ACTIONS[action]
+            score = state.getScore()
+            state = self.playRound(state, action)
+            rewards[i] = state.getScore() - score
+            if state.isWin() or state.isLose():
+                dones[i] = True
+                self.episodes += 1
+                self.finalStates[i] = state
+                state = self.newState()
+            else:
+                self.finalStates[i] = None
+            self.states[i] = state
+        return self.observations(), rewards, dones
+
+    def playRound(self, state, action):
+        "Pacman's move followed by each ghost's, stopping when the game ends"
+        state = state.generateSuccessor(0, action)
+        for ghost in self.ghostAgents:
+            if state.isWin() or state.isLose():
+                break
+            state = state.generateSuccessor(ghost.index, ghost.getAction(state))
+        return state
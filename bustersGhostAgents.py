@@ -13,8 +13,13 @@ from util import manhattanDistance
 import util
 
 class StationaryGhost( ghostAgents.GhostAgent ):
+    ignoresOtherGhosts = True
+
+    def transitionKey( self, state ):
+        return ()
+
     def getDistribution( self, state ):
-        dist = util.Counter()
+        dist = util.FastCounter()
         dist[Directions.STOP] = 1.0
         return dist
 
@@ -24,6 +29,9 @@ class DispersingGhost( ghostAgents.GhostAgent ):
         self.index = index
         self.spreadProb = spreadProb
 
+    def transitionKey( self, state ):
+        return tuple(state.getGhostPosition(i) for i in range(1, state.getNumAgents()) if i != self.index)
+
     def getDistribution( self, state ):
         ghostState = state.getGhostState( self.index )
         legalActions = state.getLegalActions( self.index )
@@ -47,7 +55,7 @@ class DispersingGhost( ghostAgents.GhostAgent ):
 
         bestDistance = min(sumOfDistances)
         numBest = [bestDistance == dist for dist in sumOfDistances].count(True)
-        distribution = util.Counter()
+        distribution = util.FastCounter()
         for action, distance in zip(legalActions, sumOfDistances):
             if distance == bestDistance: distribution[action] += old_div(self.spreadProb, numBest)
             distribution[action] += old_div((1 - self.spreadProb), len(legalActions))
@@ -14,14 +14,16 @@ distancer = Distancer(gameState.data.layout)
 distancer.getDistance( (1,1), (10,10) )
 
 The Distancer object also serves as an example of sharing data
-safely among agents via a global dictionary (distanceMap),
-and performing asynchronous computation via threads. These
+safely among agents via a global dictionary of futures (distanceFutures),
+and performing asynchronous computation in a process pool. These
 examples may help you in designing your own objects, but you
 shouldn't need to modify the Distancer code in order to use its
 distances.
 """
 
-import threading, sys, time, random
+import threading, sys, time, random, os, hashlib
+from concurrent import futures
+import numpy as np
 
 class Distancer:
   def __init__(self, layout, background=True, default=10000):
@@ -36,21 +38,17 @@ class Distancer:
     self._distances = None
     self.default = default
 
-    # Start computing distances in the background; when the dc finishes,
-    # it will fill in self._distances for us.
-    dc = DistanceCalculator()
-    dc.setAttr(layout, self)
-    dc.setDaemon(True)
-    if background:
-      dc.start()
-    else:
-      dc.run()
+    # Start computing distances in the background, or join the computation
+    # another Distancer of the same maze started
+    self.future = getDistancesFuture(layout, background)
+    if not background:
+      self._distances = self.future.result()
 
   def getDistance(self, pos1, pos2):
     """
     The getDistance function is the only one you'll need after you create the object.
     """
-    if self._distances == None:
+    if self._distances is None and not self.isReadyForMazeDistance():
       return manhattanDistance(pos1, pos2)
     if isInt(pos1) and isInt(pos2):
       return self.getDistanceOnGrid(pos1, pos2)
@@ -66,14 +64,24 @@ class Distancer:
     return bestDistance
 
   def getDistanceOnGrid(self, pos1, pos2):
-    key = (pos1, pos2)
-    if key in self._distances:
-      return self._distances[key]
-    else:
-      raise Exception("Positions not in grid: " + str(key))
+    return self._distances.getDistance(pos1, pos2)
 
   def isReadyForMazeDistance(self):
-    return self._distances != None
+    "True once the maze distances are available; until then getDistance is Manhattan"
+    if self._distances is None and self.future.done():
+      self._distances = self.future.result()
+    return self._distances is not None
+
+  def waitForMazeDistance(self, timeout=None):
+    """
+    Blocks until the maze distances are ready or timeout seconds go by.
+    Returns isReadyForMazeDistance().
+    """
+    try:
+      self.future.result(timeout)
+    except futures.TimeoutError:
+      pass
+    return self.isReadyForMazeDistance()
 
 def manhattanDistance(x, y ):
   return abs( x[0] - y[0] ) + abs( x[1] - y[1] )
@@ -99,80 +107,224 @@ def getGrids1D(x):
 # MACHINERY FOR COMPUTING MAZE DISTANCES #
 ##########################################
 
-distanceMap = {}
-distanceMapSemaphore = threading.Semaphore(1)
-distanceThread = None
+# Directory of the on-disk cache of distance matrices shared by all runs;
+# set it to None to always compute the distances
+DISTANCE_CACHE_DIR = '.distanceCache'
+
+# Futures of the DistanceMatrix of each maze, keyed by wallsKey
+distanceFutures = {}
+distanceFuturesLock = threading.Lock()
+distanceExecutor = None
 
 def waitOnDistanceCalculator(t):
-  global distanceThread
-  if distanceThread != None:
+  "Sleeps for t seconds if some maze distances are still being computed"
+  with distanceFuturesLock:
+    pending = [future for future in distanceFutures.values() if not future.done()]
+  if pending:
     time.sleep(t)
 
-class DistanceCalculator(threading.Thread):
-  def setAttr(self, layout, distancer, default = 10000):
-    self.layout = layout
-    self.distancer = distancer
-    self.default = default
+def getDistanceExecutor():
+  "The pool of processes computing maze distances, started on first use"
+  global distanceExecutor
+  if distanceExecutor is None:
+    try:
+      distanceExecutor = futures.ProcessPoolExecutor()
+    except (NotImplementedError, ImportError, OSError):
+      # No working process support: threads still keep the game going
+      distanceExecutor = futures.ThreadPoolExecutor()
+  return distanceExecutor
 
-  def run(self):
-    global distanceMap, distanceThread
-    distanceMapSemaphore.acquire()
+def getDistancesFuture(layout, background=True):
+  """
+  Returns a future of the DistanceMatrix of the layout's maze.  Each maze
+  is loaded or computed only once per process: mazes cached on disk are
+  loaded right away, others are computed in the process pool (or in this
+  thread unless background is set), and different mazes are computed in
+  parallel.
+  """
+  walls = layout.walls
+  key = wallsKey(walls)
+  with distanceFuturesLock:
+    future = distanceFutures.get(key)
+    if future is not None and not (future.done() and future.exception() is not None):
+      return future
+    future = distanceFutures[key] = futures.Future()
 
-    if self.layout.walls not in distanceMap:
-      if distanceThread != None: raise Exception('Multiple distance threads')
-      distanceThread = self
+  distances = loadCachedDistances(walls)
+  if distances is not None:
+    future.set_result(distances)
+  elif not background:
+    distances = computeDistances(layout)
+    storeDistances(distances)
+    future.set_result(distances)
+  else:
+    job = getDistanceExecutor().submit(computeDistancesInWorker, walls, DISTANCE_CACHE_DIR)
+    job.add_done_callback(lambda job: finishDistances(future, walls, job))
+  return future
 
-      distances = computeDistances(self.layout)
-      print('[Distancer]: Switching to maze distances', file=sys.stdout)
+def computeDistancesInWorker(walls, directory):
+  """
+  Body of a pool job: computes the distances of a maze and stores them in
+  the cache directory.  Returns None if they were stored (the caller maps
+  them from there), or else the matrix itself.
+  """
+  distances = DistanceMatrix(walls)
+  if storeDistances(distances, directory):
+    return None
+  return distances.matrix
 
-      distanceMap[self.layout.walls] = distances
-      distanceThread = None
-    else:
-      distances = distanceMap[self.layout.walls]
+def finishDistances(future, walls, job):
+  "Turns the result of a pool job into the DistanceMatrix of the maze"
+  try:
+    matrix = job.result()
+    distances = None
+    if matrix is None:
+      distances = loadCachedDistances(walls)
+    if distances is None:
+      distances = DistanceMatrix(walls, matrix)
+  except Exception as e:
+    future.set_exception(e)
+    return
+  print('[Distancer]: Switching to maze distances', file=sys.stdout)
+  future.set_result(distances)
+
+class DistanceMatrix:
+  """
+  The maze distances between every pair of open cells of a layout.
+
+  Each open cell has an id (its index in walls.asList(False)) and the
+  distances are held in a V x V uint16 matrix indexed by cell ids, so a
+  lookup is two dict lookups and an array access.  Pairs of cells that
+  cannot reach each other hold UNREACHABLE.  Indexing with a (pos1, pos2)
+  key works as with the dict of distances this replaces.
+  """
+  UNREACHABLE = np.iinfo(np.uint16).max
+
+  def __init__(self, walls, matrix=None):
+    self.walls = walls
+    self.cells = walls.asList(False)
+    self.cellIds = dict((cell, i) for i, cell in enumerate(self.cells))
+    if matrix is None:
+      matrix = computeDistanceMatrix(self.cells, self.cellIds)
+    self.matrix = matrix
+
+  def getDistance(self, pos1, pos2):
+    try:
+      distance = self.matrix[self.cellIds[pos1], self.cellIds[pos2]]
+    except KeyError:
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+    if distance == DistanceMatrix.UNREACHABLE: return sys.maxsize
+    return int(distance)
 
-    distanceMapSemaphore.release()
-    self.distancer._distances = distances
+  def __getitem__(self, key):
+    return self.getDistance(key[0], key[1])
+
+  def __contains__(self, key):
+    return key[0] in self.cellIds and key[1] in self.cellIds
+
+  def __len__(self):
+    return len(self.cells) ** 2
 
 def computeDistances(layout):
-    distances = {}
-    allNodes = layout.walls.asList(False)
-    for source in allNodes:
-        dist = {}
-        closed = {}
-        for node in allNodes:
-            dist[node] = sys.maxsize
-        import util
-        queue = util.PriorityQueue()
-        queue.push(source, 0)
-        dist[source] = 0
-        while not queue.isEmpty():
-            node = queue.pop()
-            if node in closed:
-                continue
-            closed[node] = True
-            nodeDist = dist[node]
-            adjacent = []
-            x, y = node
-            if not layout.isWall((x,y+1)):
-                adjacent.append((x,y+1))
-            if not layout.isWall((x,y-1)):
-                adjacent.append((x,y-1) )
-            if not layout.isWall((x+1,y)):
-                adjacent.append((x+1,y) )
-            if not layout.isWall((x-1,y)):
-                adjacent.append((x-1,y))
-            for other in adjacent:
-                if not other in dist:
-                    continue
-                oldDist = dist[other]
-                newDist = nodeDist+1
-                if newDist < oldDist:
-                    dist[other] = newDist
-                    queue.push(other, newDist)
-        for target in allNodes:
-            distances[(target, source)] = dist[target]
-    return distances
+  "Returns the DistanceMatrix of the layout's maze"
+  return DistanceMatrix(layout.walls)
+
+def wallsKey(walls):
+  "A content hash of the walls of a maze"
+  return hashlib.sha1(('%d %d %x' % (walls.width, walls.height, walls.bits)).encode()).hexdigest()
+
+def cachePath(walls, directory):
+  return os.path.join(directory, wallsKey(walls) + '.npy')
+
+def loadCachedDistances(walls, directory=None):
+  """
+  Returns the DistanceMatrix of the maze memory-mapped from the cache
+  directory (DISTANCE_CACHE_DIR by default), or None if it is not there.
+  Matrices are stored under a hash of the walls, so editing a layout's
+  maze never picks up a stale matrix.
+  """
+  if directory is None: directory = DISTANCE_CACHE_DIR
+  if directory is None: return None
+  numCells = walls.count(False)
+  try:
+    matrix = np.load(cachePath(walls, directory), mmap_mode='r')
+  except (IOError, OSError, ValueError):
+    return None
+  if matrix.shape != (numCells, numCells) or matrix.dtype != np.uint16:
+    return None
+  return DistanceMatrix(walls, matrix)
+
+def storeDistances(distances, directory=None):
+  "Stores a DistanceMatrix in the cache directory; returns whether it could"
+  if directory is None: directory = DISTANCE_CACHE_DIR
+  if directory is None: return False
+  path = cachePath(distances.walls, directory)
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    # Written under a private name and renamed, as other processes may be
+    # storing the same matrix
+    tmpPath = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmpPath, 'wb') as tmpFile:
+      np.save(tmpFile, distances.matrix)
+    os.replace(tmpPath, path)
+  except (IOError, OSError):
+    return False
+  return True
+
+def loadDistances(layout, directory=None):
+  """
+  Returns the DistanceMatrix of the layout from the cache directory, or
+  computes and stores it there.
+  """
+  distances = loadCachedDistances(layout.walls, directory)
+  if distances is None:
+    distances = computeDistances(layout)
+    storeDistances(distances, directory)
+  return distances
+
+def computeDistanceMatrix(cells, cellIds):
+  """
+  Breadth-first search from every cell at once, one level at a time.  Row
+  i of the frontier holds, as a bitset over the sources, the searches that
+  reached cell i at the current level, so a level is an OR of the rows of
+  each cell's neighbours.
+  """
+  numCells = len(cells)
+  distances = np.full((numCells, numCells), DistanceMatrix.UNREACHABLE, dtype=np.uint16)
+  if numCells == 0: return distances
+  if numCells >= DistanceMatrix.UNREACHABLE:
+    raise Exception("Maze too large for 16-bit distances: %d cells" % numCells)
+
+  # Neighbours of each cell; walls point at an extra, always empty, row
+  neighbours = np.full((numCells, 4), numCells, dtype=np.intp)
+  for i, (x, y) in enumerate(cells):
+    for k, neighbour in enumerate(((x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y))):
+      neighbours[i, k] = cellIds.get(neighbour, numCells)
+
+  numWords = (numCells + 63) // 64
+  sources = np.arange(numCells)
+  frontier = np.zeros((numCells + 1, numWords), dtype=np.uint64)
+  frontier[sources, sources // 64] = np.left_shift(np.uint64(1), (sources % 64).astype(np.uint64))
+  visited = frontier[:numCells].copy()
+  distances[sources, sources] = 0
 
+  level = 0
+  while True:
+    level += 1
+    reached = frontier[neighbours[:, 0]] | frontier[neighbours[:, 1]] | \
+              frontier[neighbours[:, 2]] | frontier[neighbours[:, 3]]
+    reached &= ~visited
+    rows, words = np.nonzero(reached)
+    if len(rows) == 0: break
+    visited |= reached
+    frontier[:numCells] = reached
+    # Unpack the words with new bits into source ids
+    bits = np.unpackbits(reached[rows, words].astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    hits = np.flatnonzero(bits)
+    hits, offsets = hits >> 6, hits & 63
+    distances[rows[hits], words[hits] * 64 + offsets] = level
+  return distances
 
 def getDistanceOnGrid(distances, pos1, pos2):
     key = (pos1, pos2)
@@ -4,10 +4,16 @@
 "Feature extractors for Pacman game states"
 
 from builtins import object
+from collections import deque
 from game import Directions, Actions
+import numpy as np
 import util
 
 class FeatureExtractor(object):
+    # Extractors with a fixed set of features list them here, in the order
+    # of the entries of getFeatureVector
+    featureNames = None
+
     def getFeatures(self, state, action):
         """
           Returns a dict from features to counts
@@ -16,9 +22,27 @@ class FeatureExtractor(object):
         """
         util.raiseNotDefined()
 
+    def getFeatureVector(self, state, action):
+        """
+          Returns the features as an array indexed like featureNames,
+          for agents that keep their weights in an array
+        """
+        if self.featureNames is None:
+            raise Exception("%s has no fixed set of features" % self.__class__.__name__)
+        features = self.getFeatures(state, action)
+        return np.array([features[name] for name in self.featureNames])
+
+    def getFeaturesBatch(self, state, actions):
+        """
+          Returns the feature vectors of all the actions as the rows of an
+          (actions x features) array.  Extractors override this to share
+          the work that does not depend on the action.
+        """
+        return np.array([self.getFeatureVector(state, action) for action in actions])
+
 class IdentityExtractor(FeatureExtractor):
     def getFeatures(self, state, action):
-        feats = util.Counter()
+        feats = util.FastCounter()
         feats[(state,action)] = 1.0
         return feats
 
@@ -27,10 +51,10 @@ def closestFood(pos, food, walls):
     closestFood -- this is similar to the function that we have
     worked on in the search project; here its all in one place
     """
-    fringe = [(pos[0], pos[1], 0)]
+    fringe = deque([(pos[0], pos[1], 0)])
     expanded = set()
     while fringe:
-        pos_x, pos_y, dist = fringe.pop(0)
+        pos_x, pos_y, dist = fringe.popleft()
         if (pos_x, pos_y) in expanded:
             continue
         expanded.add((pos_x, pos_y))
@@ -44,6 +68,7 @@ def closestFood(pos, food, walls):
     # no food found
     return None
 
+
 class SimpleExtractor(FeatureExtractor):
     """
     Returns simple features for a basic reflex Pacman:
@@ -52,33 +77,75 @@ class SimpleExtractor(FeatureExtractor):
     - whether a ghost collision is imminent
     - whether a ghost is one step away
     """
+    featureNames = ["bias", "#-of-ghosts-1-step-away", "eats-food", "closest-food"]
+
+    def __init__(self):
+        # Closest food distances of the food grid they were searched on
+        self.foodKey = None
+        self.foodDistances = {}
 
     def getFeatures(self, state, action):
+        features = util.FastCounter()
+        for name, value in zip(self.featureNames, self.getFeatureVector(state, action)):
+            if value:
+                features[name] = float(value)
+        return features
+
+    def getFeatureVector(self, state, action):
+        return self.getFeaturesBatch(state, [action])[0]
+
+    def getFeaturesBatch(self, state, actions):
         # extract the grid of food and wall locations and get the ghost locations
         food = state.getFood()
         walls = state.getWalls()
         ghosts = state.getGhostPositions()
 
-        features = util.Counter()
+        features = np.zeros((len(actions), len(self.featureNames)))
+
+        features[:, 0] = 1.0
 
-        features["bias"] = 1.0
+        # the number of ghosts 1-step away from every cell next to a ghost
+        ghostNeighbours = {}
+        for g in ghosts:
+            for cell in Actions.getLegalNeighbors(g, walls):
+                ghostNeighbours[cell] = ghostNeighbours.get(cell, 0) + 1
 
-        # compute the location of pacman after he takes the action
         x, y = state.getPacmanPosition()
-        dx, dy = Actions.directionToVector(action)
-        next_x, next_y = int(x + dx), int(y + dy)
-
-        # count the number of ghosts 1-step away
-        features["#-of-ghosts-1-step-away"] = sum((next_x, next_y) in Actions.getLegalNeighbors(g, walls) for g in ghosts)
-
-        # if there is no danger of ghosts then add the food feature
-        if not features["#-of-ghosts-1-step-away"] and food[next_x][next_y]:
-            features["eats-food"] = 1.0
-
-        dist = closestFood((next_x, next_y), food, walls)
-        if dist is not None:
-            # make the distance a number less than one otherwise the update
-            # will diverge wildly
-            features["closest-food"] = float(dist) / (walls.width * walls.height)
-        features.divideAll(10.0)
+        for row, action in enumerate(actions):
+            # compute the location of pacman after he takes the action
+            dx, dy = Actions.directionToVector(action)
+            next_x, next_y = int(x + dx), int(y + dy)
+
+            # count the number of ghosts 1-step away
+            features[row, 1] = ghostNeighbours.get((next_x, next_y), 0)
+
+            # if there is no danger of ghosts then add the food feature
+            if not features[row, 1] and food[next_x][next_y]:
+                features[row, 2] = 1.0
+
+            dist = self.getFoodDistance(state, (next_x, next_y))
+            if dist is not None:
+                # make the distance a number less than one otherwise the update
+                # will diverge wildly
+                features[row, 3] = float(dist) / (walls.width * walls.height)
+        features /= 10.0
         return features
+
+    def getFoodDistance(self, state, pos):
+        """
+        Maze distance from pos to the closest food.  Busters states keep the
+        distances to their food in a FoodIndex, shared until some food is
+        eaten; for other states the results of closestFood are kept until
+        the food changes.
+        """
+        foodIndex = getattr(state, 'foodIndex', None)
+        if foodIndex is not None:
+            return foodIndex.getMazeDistance(pos)
+        food, walls = state.getFood(), state.getWalls()
+        key = (food.bits, walls.bits)
+        if key != self.foodKey:
+            self.foodKey = key
+            self.foodDistances = {}
+        if pos not in self.foodDistances:
+            self.foodDistances[pos] = closestFood(pos, food, walls)
+        return self.foodDistances[pos]
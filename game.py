@@ -2,6 +2,7 @@
 # -------
 
 from util import *
+import array
 import time, os
 import traceback
 import sys
@@ -140,69 +141,117 @@ class AgentState:
 
 class Grid:
     """
-    A 2-dimensional array of objects backed by a list of lists.  Data is accessed
-    via grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
-    y vertical and the origin (0,0) in the bottom left corner.
+    A 2-dimensional array of booleans.  Data is accessed via grid[x][y] where
+    (x,y) are positions on a Pacman map with x horizontal, y vertical and the
+    origin (0,0) in the bottom left corner.
+
+    The grid is a bitboard: cell (x,y) is bit x * height + y of the integer
+    grid.bits.  Integers are immutable, so copies share them and cost O(1);
+    count uses a popcount and the hash is cached until the grid changes.
+    grid[x] returns a GridColumn, a list of the booleans of column x that
+    writes through to the bits; each column is built on its first access.
 
     The __str__ method constructs an output that is oriented like a pacman board.
     """
+    CELLS_PER_INT = 30
+
     def __init__(self, width, height, initialValue=False, bitRepresentation=None):
         if initialValue not in [False, True]: raise Exception('Grids can only contain booleans')
-        self.CELLS_PER_INT = 30
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self.bits = (1 << (width * height)) - 1 if initialValue else 0
+        self._hash = None
+        self._columns = {}
+        # Set by Actions.getLegalActionTable when the grid holds walls
+        self._legalActionTables = None
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
     def __getitem__(self, i):
-        return self.data[i]
+        try:
+            return self._columns[i]
+        except KeyError:
+            x = i + self.width if i < 0 else i
+            if not 0 <= x < self.width: raise IndexError('Grid index out of range')
+            column = self._columns.get(x)
+            if column is None:
+                column = self._columns[x] = GridColumn(self, x)
+            return column
 
     def __setitem__(self, key, item):
-        self.data[key] = item
+        column = self[key]
+        for y in range(self.height):
+            column[y] = item[y]
+
+    def __iter__(self):
+        for x in range(self.width):
+            yield self[x]
+
+    def __len__(self):
+        return self.width
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_columns'] = {}
+        state['_legalActionTables'] = None
+        return state
 
     def __str__(self):
-        out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out = [[str(self[x][y])[0] for x in range(self.width)] for y in range(self.height)]
         out.reverse()
         return '\n'.join([''.join(x) for x in out])
 
     def __eq__(self, other):
-        if other == None: return False
-        return self.data == other.data
+        if not isinstance(other, Grid): return False
+        return self.bits == other.bits and self.width == other.width and self.height == other.height
 
     def __hash__(self):
-        # return hash(str(self))
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        if self._hash is None:
+            self._hash = hash(self.bits)
+        return self._hash
+
+    def set(self, x, y, value):
+        bit = 1 << (x * self.height + y)
+        if value:
+            self.bits |= bit
+        else:
+            self.bits &= ~bit
+        self._hash = None
+        self._legalActionTables = None
+        column = self._columns.get(x)
+        if column is not None:
+            list.__setitem__(column, y, bool(value))
 
     def copy(self):
         g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g.bits = self.bits
+        g._hash = self._hash
         return g
 
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
-        g.data = self.data
-        return g
+        "Same as copy: the bits are immutable and always shared"
+        return self.copy()
 
     def count(self, item =True ):
-        return sum([x.count(item) for x in self.data])
+        ones = bin(self.bits).count('1')
+        if item: return ones
+        return self.width * self.height - ones
 
     def asList(self, key = True):
+        bits = self.bits
+        if not key:
+            bits = ~bits & ((1 << (self.width * self.height)) - 1)
         list = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key: list.append( (x,y) )
+        height = self.height
+        while bits:
+            lowest = bits & -bits
+            index = lowest.bit_length() - 1
+            list.append( (index // height, index % height) )
+            bits ^= lowest
         return list
 
     def packBits(self):
@@ -225,7 +274,7 @@ class Grid:
         return tuple(bits)
 
     def _cellIndexToPosition(self, index):
-        x = index / self.height
+        x = index // self.height
         y = index % self.height
         return x, y
 
@@ -253,6 +302,24 @@ class Grid:
                 bools.append(False)
         return bools
 
+class GridColumn(list):
+    """
+    Column x of a Grid, indexed by y.  It is a list of the column's booleans,
+    so reads are plain list lookups; writes go through to the grid's bits.
+    """
+    def __init__(self, grid, x):
+        height = grid.height
+        bits = grid.bits >> (x * height)
+        list.__init__(self, [(bits >> y) & 1 == 1 for y in range(height)])
+        self.grid = grid
+        self.x = x
+
+    def __setitem__(self, y, value):
+        height = self.grid.height
+        if y < 0: y += height
+        if not 0 <= y < height: raise IndexError('Grid column index out of range')
+        self.grid.set(self.x, y, value)
+
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
         return bitRep
@@ -276,6 +343,12 @@ class Actions:
 
     _directionsAsList = list(_directions.items())
 
+    # Bits of the legal action masks; Stop is always legal so it has none
+    _directionBits = {Directions.NORTH: 1,
+                      Directions.SOUTH: 2,
+                      Directions.EAST:  4,
+                      Directions.WEST:  8}
+
     TOLERANCE = .001
 
     def reverseDirection(action):
@@ -308,7 +381,44 @@ class Actions:
         return (dx * speed, dy * speed)
     directionToVector = staticmethod(directionToVector)
 
+    def getLegalActionTable(walls):
+        """
+        Returns the legal actions of every open cell of the maze with these
+        walls, as two dicts keyed by (x,y): one holding the actions as a tuple
+        in the order getPossibleActions lists them (equal tuples are shared),
+        the other the bitmask of the actions other than Stop (see
+        _directionBits).  The tables are built on the first call and kept on
+        the walls grid until it changes.
+        """
+        tables = walls._legalActionTables
+        if tables is None:
+            interned = {}
+            legalActions = {}
+            legalMasks = {}
+            for x in range(walls.width):
+                for y in range(walls.height):
+                    if walls[x][y]: continue
+                    possible = []
+                    for dir, vec in Actions._directionsAsList:
+                        dx, dy = vec
+                        next_x, next_y = x + dx, y + dy
+                        if 0 <= next_x < walls.width and 0 <= next_y < walls.height and not walls[next_x][next_y]:
+                            possible.append(dir)
+                    possible = interned.setdefault(tuple(possible), tuple(possible))
+                    legalActions[(x, y)] = possible
+                    legalMasks[(x, y)] = sum([Actions._directionBits.get(dir, 0) for dir in possible])
+            tables = walls._legalActionTables = (legalActions, legalMasks)
+        return tables
+    getLegalActionTable = staticmethod(getLegalActionTable)
+
     def getPossibleActions(config, walls):
+        # Agents standing on a cell of a maze with a table use it
+        tables = walls._legalActionTables
+        if tables is not None:
+            possible = tables[0].get(config.pos)
+            if possible is not None:
+                return list(possible)
+
         possible = []
         x, y = config.pos
         x_int, y_int = int(x + 0.5), int(y + 0.5)
@@ -349,16 +459,24 @@ class Actions:
 
 class GameStateData:
     """
-
+    The data of a game state.  Copies are copy-on-write: a new GameStateData
+    shares the layout, the food grid, the capsule list and the AgentStates of
+    its predecessor, so none of them may be modified in place.  Code that
+    changes the board must assign a new food grid or capsule list, and code
+    that changes an agent must go through getWritableAgentState.
     """
     def __init__( self, prevState = None ):
         """
         Generates a new data packet by copying information from its predecessor.
         """
         if prevState != None:
-            self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            self.food = prevState.food
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
+            # The AgentStates are now shared by both packets; each keeps its
+            # own flags, as a write copies the state for that packet only
+            prevState._ownedAgentStates = [False] * len(self.agentStates)
+            self._ownedAgentStates = [False] * len(self.agentStates)
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
@@ -372,9 +490,8 @@ class GameStateData:
         self.scoreChange = 0
 
     def deepCopy( self ):
+        "A copy that also keeps the bookkeeping of the last move (see __init__)"
         state = GameStateData( self )
-        state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
@@ -387,6 +504,16 @@ class GameStateData:
             copiedStates.append( agentState.copy() )
         return copiedStates
 
+    def getWritableAgentState( self, index ):
+        """
+        Returns the AgentState of agent index, first copying it if it is
+        shared with another GameStateData.
+        """
+        if not self._ownedAgentStates[index]:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgentStates[index] = True
+        return self.agentStates[index]
+
     def __eq__( self, other ):
         """
         Allows two states to be compared.
@@ -413,7 +540,7 @@ class GameStateData:
 
     def __str__( self ):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
+        map = [[' ' for y in range(height)] for x in range(width)]
         if type(self.food) == type((1,2)):
             self.food = reconstituteGrid(self.food)
         for x in range(width):
@@ -434,7 +561,9 @@ class GameStateData:
         for x, y in self.capsules:
             map[x][y] = 'o'
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        rows = [''.join([map[x][y] for x in range(width)]) for y in range(height)]
+        rows.reverse()
+        return '\n'.join(rows) + ("\nScore: %d\n" % self.score)
 
     def _foodWallStr( self, hasFood, hasWall ):
         if hasFood:
@@ -480,6 +609,7 @@ class GameStateData:
                 if numGhosts == numGhostAgents: continue # Max ghosts reached already
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
+        self._ownedAgentStates = [True for a in self.agentStates]
         self._eaten = [False for a in self.agentStates]
 
 try:
@@ -488,6 +618,77 @@ try:
 except:
     _BOINC_ENABLED = False
 
+# The actions a MoveHistory can record, in the order of their codes
+MOVE_ACTIONS = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP]
+MOVE_ACTION_CODES = dict((action, code) for code, action in enumerate(MOVE_ACTIONS))
+
+class MoveHistory:
+    """
+    The moves of a game, as a sequence of (agentIndex, action) pairs.
+
+    A move is recorded as the code agentIndex * len(MOVE_ACTIONS) + the index
+    of its action, stored into a preallocated chunk of CHUNK_MOVES slots.
+    Full chunks are handed to flushChunk, which packs them into an array of
+    16-bit codes; subclasses also stream them elsewhere (see gameRecorder.py).
+    Every chunk but the last is full, so move i is found directly in chunk
+    i // CHUNK_MOVES: flush() the last, partial chunk once the game is over.
+    """
+    CHUNK_MOVES = 256
+
+    def __init__(self):
+        self.chunks = []
+        self.chunk = [0] * MoveHistory.CHUNK_MOVES
+        self.pending = 0
+        self.numFlushed = 0
+
+    def append(self, move):
+        "Records an (agentIndex, action) move"
+        self.record(move[0], move[1])
+
+    def record(self, agentIndex, action):
+        code = MOVE_ACTION_CODES.get(action)
+        if code is None:
+            raise Exception("Cannot record the action %s" % str(action))
+        self.chunk[self.pending] = agentIndex * len(MOVE_ACTIONS) + code
+        self.pending += 1
+        if self.pending == MoveHistory.CHUNK_MOVES:
+            self.flush()
+
+    def flush(self):
+        "Hands the moves of the current chunk, if any, to flushChunk"
+        if self.pending == 0: return
+        codes, self.pending = self.chunk[:self.pending], 0
+        self.numFlushed += len(codes)
+        self.flushChunk(codes)
+
+    def flushChunk(self, codes):
+        self.chunks.append(array.array('H', codes))
+
+    def getCodes(self):
+        "The codes of all the moves"
+        codes = []
+        for chunk in self.chunks:
+            codes.extend(chunk)
+        codes.extend(self.chunk[:self.pending])
+        return codes
+
+    def __len__(self):
+        return self.numFlushed + self.pending
+
+    def __iter__(self):
+        for code in self.getCodes():
+            yield (code // len(MOVE_ACTIONS), MOVE_ACTIONS[code % len(MOVE_ACTIONS)])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError('Move index out of range')
+        chunk, offset = divmod(i, MoveHistory.CHUNK_MOVES)
+        codes = self.chunks[chunk] if chunk < len(self.chunks) else self.chunk
+        code = codes[offset]
+        return (code // len(MOVE_ACTIONS), MOVE_ACTIONS[code % len(MOVE_ACTIONS)])
+
 class Game:
     """
     The Game manages the control flow, soliciting actions from agents.
@@ -502,7 +703,7 @@ class Game:
         self.gameOver = False
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
-        self.moveHistory = []
+        self.moveHistory = MoveHistory()
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
         self.agentTimeout = False
@@ -561,11 +762,11 @@ class Game:
                 self.unmute()
                 self._agentCrash(i, quiet=True)
                 return
-            if ("registerInitialState" in dir(agent)):
+            if hasattr(agent, "registerInitialState"):
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
+                        timed_func = TimeoutFunction(agent.registerInitialState, self.rules.getMaxStartupTime(i))
                         try:
                             start_time = time.time()
                             timed_func(self.state.deepCopy())
@@ -589,17 +790,22 @@ class Game:
         agentIndex = self.startingIndex
         numAgents = len( self.agents )
 
+        if not self.catchExceptions and not self.muteAgents:
+            self._runFast(agentIndex)
+            self._endGame()
+            return
+
         while not self.gameOver:
             # Fetch the next agent
             agent = self.agents[agentIndex]
             move_time = 0
             skip_action = False
             # Generate an observation of the state
-            if 'observationFunction' in dir( agent ):
+            if hasattr(agent, 'observationFunction'):
                 self.mute(agentIndex)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
+                        timed_func = TimeoutFunction(agent.observationFunction, self.rules.getMoveTimeout(agentIndex))
                         try:
                             start_time = time.time()
                             observation = timed_func(self.state.deepCopy())
@@ -622,7 +828,7 @@ class Game:
             self.mute(agentIndex)
             if self.catchExceptions:
                 try:
-                    timed_func = TimeoutFunction(agent.getAction, int(self.rules.getMoveTimeout(agentIndex)) - int(move_time))
+                    timed_func = TimeoutFunction(agent.getAction, self.rules.getMoveTimeout(agentIndex) - move_time)
                     try:
                         start_time = time.time()
                         if skip_action:
@@ -665,7 +871,6 @@ class Game:
             self.unmute()
 
             # Execute the action
-            self.moveHistory.append( (agentIndex, action) )
             if self.catchExceptions:
                 try:
                     self.state = self.state.generateSuccessor( agentIndex, action )
@@ -676,6 +881,7 @@ class Game:
                     return
             else:
                 self.state = self.state.generateSuccessor( agentIndex, action )
+            self.moveHistory.append( (agentIndex, action) )
 
             # Change the display
             self.display.update( self.state.data )
@@ -692,19 +898,62 @@ class Game:
             if _BOINC_ENABLED:
                 boinc.set_fraction_done(self.getProgress())
 
-        # GAME HAS ENDED
-        from qlearningAgents import PacmanQAgent
+        self._endGame()
 
-        pacman_agent = self.agents[0]
-        state = self.state.deepCopy()
+    def _runFast(self, agentIndex):
+        """
+        The main loop without timeouts, output muting or crash handling.
+        The agents' hooks are looked up once, and a display flagged
+        NULL_DISPLAY is never updated.
+        """
+        numAgents = len(self.agents)
+        observers = [getattr(agent, 'observationFunction', None) for agent in self.agents]
+        actors = [agent.getAction for agent in self.agents]
+        update = None if getattr(self.display, 'NULL_DISPLAY', False) else self.display.update
+        process = self.rules.process
+        recordMove = getattr(self.moveHistory, 'record', None)
+        if recordMove is None:
+            appendMove = self.moveHistory.append
+            recordMove = lambda agentIndex, action: appendMove( (agentIndex, action) )
+
+        while not self.gameOver:
+            # Generate an observation of the state and solicit an action
+            observer = observers[agentIndex]
+            if observer is not None:
+                observation = observer(self.state.deepCopy())
+            else:
+                observation = self.state.deepCopy()
+            action = actors[agentIndex](observation)
 
-        if isinstance(pacman_agent, PacmanQAgent) and state.isWin():
-            pacman_agent.observationFunction(state)
+            # Execute the action
+            self.state = self.state.generateSuccessor( agentIndex, action )
+            recordMove( agentIndex, action )
+            if update is not None:
+                update( self.state.data )
+
+            # Allow for game specific conditions (winning, losing, etc.)
+            process(self.state, self)
+            # Track progress
+            if agentIndex == numAgents + 1: self.numMoves += 1
+            # Next agent
+            agentIndex = ( agentIndex + 1 ) % numAgents
+
+            if _BOINC_ENABLED:
+                boinc.set_fraction_done(self.getProgress())
+
+    def _endGame(self):
+        # GAME HAS ENDED
+        if hasattr(self.moveHistory, 'flush'):
+            self.moveHistory.flush()
+        pacman_agent = self.agents[0]
 
+        # Agents that learn from observationFunction see the winning state too
+        if getattr(pacman_agent, 'observeWinningState', False) and self.state.isWin():
+            pacman_agent.observationFunction(self.state.deepCopy())
 
         # inform a learning agent of the game result
         for agentIndex, agent in enumerate(self.agents):
-            if "final" in dir( agent ) :
+            if hasattr(agent, "final"):
                 try:
                     self.mute(agentIndex)
                     agent.final( self.state )
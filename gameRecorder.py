@@ -0,0 +1,253 @@
+# gameRecorder.py
+# ---------------
+
+"""
+Compact binary recordings of pacman games, written while the game runs.
+
+A recording is a header followed by append-only chunks of moves:
+
+  header - MAGIC, the format VERSION, the sha1 of the layout text (20
+           bytes), then the layout text as a varint length followed by its
+           UTF-8 bytes (length 0 when the layout is not embedded)
+  chunk  - the varint number of moves in the chunk, the varint length of
+           its payload, then the payload, then the varint length of a
+           snapshot followed by the snapshot (length 0 when there is none)
+
+Each move of a payload is the varint agentIndex * len(ACTIONS) + the index
+of the action in ACTIONS (the code of game.MoveHistory), so a typical move
+takes a single byte.  A chunk is written and flushed every CHUNK_MOVES
+moves, when the game's MoveHistory fills a chunk, so a crash loses at most
+the moves of one chunk, and a reader can find any move from the chunk
+headers alone, without decoding the moves before it.
+
+The snapshot of a chunk is the pickled GameStateData (without its layout)
+after the last move of the chunk, so a replay can seek to any move by
+playing on from the nearest snapshot before it rather than from the start
+of the game.  Recordings of VERSION 1 had no snapshots.
+
+  recorder = GameRecorder('game.rec', layout)
+  game.moveHistory = MoveHistory(recorder, game)
+  game.run()
+  recorder.close()
+
+  recording = GameRecording('game.rec')
+  recording.getMoves(1000, 1100)     # decodes only the chunks holding them
+  recording.getSnapshot(1050)        # the state after move 1024
+"""
+
+import copy
+import hashlib
+import pickle
+import game
+import layout as layoutModule
+
+MAGIC = b'PMRC'
+VERSION = 2
+ACTIONS = game.MOVE_ACTIONS
+ACTION_CODES = game.MOVE_ACTION_CODES
+
+# Moves per chunk
+CHUNK_MOVES = game.MoveHistory.CHUNK_MOVES
+
+def encodeVarint(value, out):
+    "Appends an unsigned LEB128 varint to the bytearray out"
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decodeVarint(data, offset):
+    "Returns the varint at data[offset] and the offset past it"
+    value, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def readVarint(f):
+    "Reads a varint from a file; None at the end of the file"
+    value, shift = 0, 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            if shift == 0: return None
+            raise Exception('Truncated recording')
+        byte = byte[0]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value
+        shift += 7
+
+def layoutHash(layout):
+    "The sha1 of a layout's text, which identifies it in recordings"
+    return hashlib.sha1('\n'.join(layout.layoutText).encode('utf-8')).digest()
+
+def isRecording(path):
+    "Whether the file at path is a binary recording (rather than a pickle)"
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class GameRecorder(object):
+    """
+    Streams the moves of a game to a recording.  Leave embedLayout off when
+    archiving many games of a known layout: the header then only holds its
+    hash, and the layout has to be supplied to read the recording back.
+    """
+    def __init__(self, path, layout, embedLayout=True):
+        self.file = open(path, 'wb')
+        header = bytearray(MAGIC)
+        header.append(VERSION)
+        header.extend(layoutHash(layout))
+        text = '\n'.join(layout.layoutText).encode('utf-8') if embedLayout else b''
+        encodeVarint(len(text), header)
+        header.extend(text)
+        self.file.write(header)
+        self.pending = bytearray()
+        self.pendingMoves = 0
+        self.numMoves = 0
+
+    def record(self, agentIndex, action):
+        encodeVarint(agentIndex * len(ACTIONS) + ACTION_CODES[action], self.pending)
+        self.pendingMoves += 1
+        self.numMoves += 1
+        if self.pendingMoves >= CHUNK_MOVES:
+            self.flush()
+
+    def recordChunk(self, codes, stateData=None):
+        """
+        Writes the codes of a chunk of moves (see game.MoveHistory) as a
+        chunk, with a snapshot of stateData, the state after its last move
+        """
+        self.flush()
+        for code in codes:
+            encodeVarint(code, self.pending)
+        self.pendingMoves = len(codes)
+        self.numMoves += len(codes)
+        self.flush(stateData)
+
+    def flush(self, stateData=None):
+        "Writes the pending moves as a chunk, with a snapshot of stateData if given"
+        if self.pendingMoves == 0: return
+        chunk = bytearray()
+        encodeVarint(self.pendingMoves, chunk)
+        encodeVarint(len(self.pending), chunk)
+        chunk.extend(self.pending)
+        snapshot = b''
+        if stateData is not None:
+            # The layout is in the header already
+            stateData = copy.copy(stateData)
+            stateData.layout = None
+            snapshot = pickle.dumps(stateData, pickle.HIGHEST_PROTOCOL)
+        encodeVarint(len(snapshot), chunk)
+        chunk.extend(snapshot)
+        self.file.write(chunk)
+        self.file.flush()
+        self.pending = bytearray()
+        self.pendingMoves = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class MoveHistory(game.MoveHistory):
+    """
+    A Game.moveHistory that also streams each chunk of moves to a
+    GameRecorder, with a snapshot of the state of the game when given one.
+    Moves are recorded once they have been played, so the game's state is
+    the one after the last move of the chunk.
+    """
+    def __init__(self, recorder, recordedGame=None):
+        game.MoveHistory.__init__(self)
+        self.recorder = recorder
+        self.game = recordedGame
+
+    def flushChunk(self, codes):
+        game.MoveHistory.flushChunk(self, codes)
+        stateData = self.game.state.data if self.game is not None else None
+        self.recorder.recordChunk(codes, stateData)
+
+class GameRecording(object):
+    """
+    A recording opened for reading.  Only the header and the chunk headers
+    are read up front; moves are decoded on demand.  layout is needed when
+    the recording does not embed its layout, and is checked against the
+    recorded hash.
+    """
+    def __init__(self, path, layout=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception('%s is not a game recording' % path)
+            self.version = f.read(1)[0]
+            if self.version not in (1, VERSION):
+                raise Exception('Unsupported recording version %d' % self.version)
+            self.layoutHash = f.read(20)
+            text = f.read(readVarint(f)).decode('utf-8')
+            if text:
+                layout = layoutModule.Layout(text.split('\n'))
+            if layout is None:
+                raise Exception('%s does not embed its layout; one must be given' % path)
+            if layoutHash(layout) != self.layoutHash:
+                raise Exception('The layout does not match the one %s was recorded on' % path)
+            self.layout = layout
+
+            # (first move, number of moves, payload offset, payload length) of each chunk
+            self.chunks = []
+            # (move, offset, length) of each snapshot, the move being the
+            # number of moves played before it
+            self.snapshots = []
+            self.numMoves = 0
+            while True:
+                numMoves = readVarint(f)
+                if numMoves is None: break
+                length = readVarint(f)
+                self.chunks.append((self.numMoves, numMoves, f.tell(), length))
+                self.numMoves += numMoves
+                f.seek(length, 1)
+                if self.version >= 2:
+                    length = readVarint(f)
+                    if length:
+                        self.snapshots.append((self.numMoves, f.tell(), length))
+                        f.seek(length, 1)
+
+    def __len__(self):
+        return self.numMoves
+
+    def iterMoves(self, start=0, stop=None):
+        "Yields the (agentIndex, action) moves from start to stop, a chunk at a time"
+        if stop is None or stop > self.numMoves: stop = self.numMoves
+        with open(self.path, 'rb') as f:
+            for firstMove, numMoves, offset, length in self.chunks:
+                if firstMove + numMoves <= start: continue
+                if firstMove >= stop: break
+                f.seek(offset)
+                data = f.read(length)
+                position = 0
+                for move in range(firstMove, firstMove + numMoves):
+                    code, position = decodeVarint(data, position)
+                    if start <= move < stop:
+                        yield (code // len(ACTIONS), ACTIONS[code % len(ACTIONS)])
+
+    def getMoves(self, start=0, stop=None):
+        return list(self.iterMoves(start, stop))
+
+    def getSnapshot(self, move):
+        """
+        Returns (snapshotMove, stateData) for the latest snapshot taken at
+        or before move, stateData being the GameStateData once the first
+        snapshotMove moves have been played; (0, None) when there is none.
+        """
+        best = None
+        for snapshot in self.snapshots:
+            if snapshot[0] > move: break
+            best = snapshot
+        if best is None: return 0, None
+        snapshotMove, offset, length = best
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            stateData = pickle.loads(f.read(length))
+        stateData.layout = self.layout
+        return snapshotMove, stateData
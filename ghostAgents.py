@@ -24,9 +24,22 @@ from util import manhattanDistance
 import util
 
 class GhostAgent( Agent ):
+    # Whether getDistribution ignores the positions of the other ghosts, so
+    # that the inference modules can move each ghost on its own
+    ignoresOtherGhosts = False
+
     def __init__( self, index ):
         self.index = index
 
+    def transitionKey( self, state ):
+        """
+        A hashable key of everything in state, besides the ghost's own
+        position, that getDistribution reads: the inference modules reuse
+        the ghost's motion model across states with the same key.  None (the
+        default) rebuilds the model for every state.
+        """
+        return None
+
     def getAction( self, state ):
         dist = self.getDistribution(state)
         if len(dist) == 0:
@@ -40,23 +53,38 @@ class GhostAgent( Agent ):
 
 class RandomGhost( GhostAgent ):
     "A ghost that chooses a legal action uniformly at random."
+    ignoresOtherGhosts = True
+
+    def transitionKey( self, state ):
+        return ()
+
     def getDistribution( self, state ):
-        dist = util.Counter()
+        dist = util.FastCounter()
         for a in state.getLegalActions( self.index ): dist[a] = 1.0
         dist.normalize()
         return dist
 
 class StaticGhost( GhostAgent ):
+    ignoresOtherGhosts = True
+
+    def transitionKey( self, state ):
+        return ()
+
     def getDistribution( self, state):
         return []
 
 class DirectionalGhost( GhostAgent ):
     "A ghost that prefers to rush Pacman, or flee when scared."
+    ignoresOtherGhosts = True
+
     def __init__( self, index, prob_attack=0.8, prob_scaredFlee=0.8 ):
         self.index = index
         self.prob_attack = prob_attack
         self.prob_scaredFlee = prob_scaredFlee
 
+    def transitionKey( self, state ):
+        return state.getPacmanPosition()
+
     def getDistribution( self, state ):
         # Read variables from state
         ghostState = state.getGhostState( self.index )
@@ -86,7 +114,7 @@ class DirectionalGhost( GhostAgent ):
         bestActions = [action for action, distance in zip( legalActions, distancesToPacman ) if distance == bestScore]
 
         # Construct distribution
-        dist = util.Counter()
+        dist = util.FastCounter()
         for a in bestActions: dist[a] = old_div(bestProb, len(bestActions))
         for a in legalActions: dist[a] += old_div(( 1-bestProb ), len(legalActions))
         dist.normalize()
@@ -9,6 +9,7 @@ import util
 import random
 import busters
 import game
+import numpy as np
 
 class InferenceModule(object):
     """
@@ -38,8 +39,8 @@ class InferenceModule(object):
         below.
         """
         ghostPosition = gameState.getGhostPosition(self.index) # The position you set
-        actionDist = self.ghostAgent.getDistribution(gameState)
-        dist = util.Counter()
+        actionDist = getActionDistribution(self.ghostAgent, gameState)
+        dist = util.FastCounter()
         for action, prob in list(actionDist.items()):
             successorPosition = game.Actions.getSuccessor(ghostPosition, action)
             dist[successorPosition] = prob
@@ -104,133 +105,239 @@ class ExactInference(InferenceModule):
     """
     The exact dynamic inference module should use forward-algorithm updates to
     compute the exact belief function at each time step.
+
+    The beliefs are a dense array over self.positions, the legal positions
+    followed by the jail.  An observation multiplies them by the emission
+    probability of each cell's Manhattan distance to Pacman, looked up in a
+    matrix of those distances; an elapse is a product with the sparse
+    transition matrix of the ghost (see GhostTransitions).
     """
 
     def initializeUniformly(self, gameState):
         "Begin with a uniform distribution over ghost positions."
-        self.beliefs = util.Counter()
-        for p in self.legalPositions: self.beliefs[p] = 1.0
-        self.beliefs.normalize()
+        self.positions = self.legalPositions + [self.getJailPosition()]
+        self.positionIds = dict((p, i) for i, p in enumerate(self.positions))
+        self.jailId = len(self.positions) - 1
+        self.distances = getManhattanMatrix(gameState.getWalls(), self.legalPositions)
+        self.transitions = GhostTransitions(self.ghostAgent, self.legalPositions)
+        self.resetBeliefs()
+
+    def resetBeliefs(self):
+        "A uniform distribution over the legal positions"
+        self.beliefArray = np.ones(len(self.positions))
+        self.beliefArray[self.jailId] = 0.0
+        self.beliefArray /= max(1, len(self.legalPositions))
+        self.beliefs = None
 
     def observe(self, observation, gameState):
         """
         Updates beliefs based on the distance observation and Pacman's position.
 
         The noisyDistance is the estimated Manhattan distance to the ghost you
-        are tracking.
-
-        The emissionModel below stores the probability of the noisyDistance for
-        any true distance you supply. That is, it stores P(noisyDistance |
-        TrueDistance).
-
-        self.legalPositions is a list of the possible ghost positions (you
-        should only consider positions that are in self.legalPositions).
-
-        A correct implementation will handle the following special case:
-          *  When a ghost is captured by Pacman, all beliefs should be updated
-             so that the ghost appears in its prison cell, position
-             self.getJailPosition()
-
-             You can check if a ghost has been captured by Pacman by
-             checking if it has a noisyDistance of None (a noisy distance
-             of None will be returned if, and only if, the ghost is
-             captured).
+        are tracking; P(noisyDistance | trueDistance) is looked up for every
+        legal position at once.  A noisyDistance of None means the ghost was
+        captured, so all the belief moves to its prison cell,
+        self.getJailPosition().
         """
         noisyDistance = observation
-        emissionModel = busters.getObservationDistribution(noisyDistance)
-        pacmanPosition = gameState.getPacmanPosition()
-       
-        "*** YOUR CODE HERE ***"
-        ##AA
-        '''print("Estamos Aqui")
-        print(pacmanPosition)
-        print(noisyDistance)
-        print(emissionModel)
-        print("Estamos Aqui")
-        ##move = Directions.WEST
-        #AA'''
-        ##util.raiseNotDefined()
-
-        # Replace this code with a correct observation update
-        # Be sure to handle the "jail" edge case where the ghost is eaten
-        # and noisyDistance is None
-        allPossible = util.Counter()
-        for p in self.legalPositions:
-            trueDistance = util.manhattanDistance(p, pacmanPosition)
-            if emissionModel[trueDistance] > 0:
-                allPossible[p] = 1.0
-
-        "*** END YOUR CODE HERE ***"
-
-        allPossible.normalize()
-        self.beliefs = allPossible
+        if noisyDistance is None:
+            self.beliefArray = np.zeros(len(self.positions))
+            self.beliefArray[self.jailId] = 1.0
+            self.beliefs = None
+            return
+
+        distances = self.distances.getRow(gameState.getPacmanPosition())
+        emission = getEmissionArray(noisyDistance, self.distances.size)
+        self.beliefArray[:self.jailId] *= emission[distances]
+        # A ghost with a reading is not in jail
+        self.beliefArray[self.jailId] = 0.0
+        self.normalizeBeliefs()
 
     def elapseTime(self, gameState):
         """
-        Update self.beliefs in response to a time step passing from the current
-        state.
-
-        The transition model is not entirely stationary: it may depend on
-        Pacman's current position (e.g., for DirectionalGhost).  However, this
-        is not a problem, as Pacman's current position is known.
-
-        In order to obtain the distribution over new positions for the ghost,
-        given its previous position (oldPos) as well as Pacman's current
-        position, use this line of code:
-
-          newPosDist = self.getPositionDistribution(self.setGhostPosition(gameState, oldPos))
-
-        Note that you may need to replace "oldPos" with the correct name of the
-        variable that you have used to refer to the previous ghost position for
-        which you are computing this distribution. You will need to compute
-        multiple position distributions for a single update.
-
-        newPosDist is a util.Counter object, where for each position p in
-        self.legalPositions,
-
-        newPostDist[p] = Pr( ghost is at position p at time t + 1 | ghost is at position oldPos at time t )
-
-        (and also given Pacman's current position).  You may also find it useful
-        to loop over key, value pairs in newPosDist, like:
-
-          for newPos, prob in newPosDist.items():
-            ...
-
-        *** GORY DETAIL AHEAD ***
+        Update the beliefs in response to a time step passing from the current
+        state: beliefs[newPos] = sum over oldPos of P(newPos | oldPos) beliefs[oldPos],
+        with P given by the ghost agent (see getPositionDistribution).  The
+        transition model may depend on Pacman's current position (e.g., for
+        DirectionalGhost), which is known.
+        """
+        sources, targets, probs = self.transitions.getMatrix(gameState)
+        self.beliefArray = np.bincount(targets, weights=self.beliefArray[sources] * probs,
+                                       minlength=len(self.positions))
+        self.normalizeBeliefs()
+
+    def normalizeBeliefs(self):
+        "Normalizes the beliefs, starting over from the uniform prior if they are all zero"
+        total = self.beliefArray.sum()
+        if total > 0:
+            self.beliefArray /= total
+            self.beliefs = None
+        else:
+            self.resetBeliefs()
 
-        As an implementation detail (with which you need not concern yourself),
-        the line of code at the top of this comment block for obtaining
-        newPosDist makes use of two helper methods provided in InferenceModule
-        above:
+    def getBeliefDistribution(self):
+        if self.beliefs is None:
+            self.beliefs = util.FastCounter()
+            for i in np.flatnonzero(self.beliefArray):
+                self.beliefs[self.positions[i]] = float(self.beliefArray[i])
+        return self.beliefs
 
-          1) self.setGhostPosition(gameState, ghostPosition)
-              This method alters the gameState by placing the ghost we're
-              tracking in a particular position.  This altered gameState can be
-              used to query what the ghost would do in this position.
+class ManhattanMatrix(object):
+    """
+    The Manhattan distances from every open cell of a maze (where Pacman may
+    be) to each of a list of positions, as a uint16 matrix.
+    """
+    def __init__(self, walls, positions):
+        cells = walls.asList(False)
+        self.cellIds = dict((cell, i) for i, cell in enumerate(cells))
+        cellArray = np.array(cells, dtype=np.int64).reshape(-1, 2)
+        positionArray = np.array(positions, dtype=np.int64).reshape(-1, 2)
+        self.positionArray = positionArray
+        self.matrix = (np.abs(cellArray[:, 0:1] - positionArray[:, 0]) +
+                       np.abs(cellArray[:, 1:2] - positionArray[:, 1])).astype(np.uint16)
+        # Lookup arrays must cover any distance a row holds
+        self.size = walls.width + walls.height
+
+    def getRow(self, pos):
+        "The distances from pos to each position"
+        i = self.cellIds.get(pos)
+        if i is not None:
+            return self.matrix[i]
+        return np.abs(self.positionArray[:, 0] - int(pos[0])) + np.abs(self.positionArray[:, 1] - int(pos[1]))
+
+manhattanMatrices = {}
+def getManhattanMatrix(walls, positions):
+    "The ManhattanMatrix of a maze and positions, shared by the inference modules"
+    key = (walls, tuple(positions))
+    if key not in manhattanMatrices:
+        manhattanMatrices[key] = ManhattanMatrix(walls, positions)
+    return manhattanMatrices[key]
+
+def getEmissionArray(noisyDistance, size):
+    """
+    P(noisyDistance | trueDistance) as a read-only array indexed by the true
+    distance, from 0 to size - 1: a row of busters.getObservationMatrix.
+    """
+    return busters.getObservationMatrix(max(size, noisyDistance + 1))[noisyDistance, :size]
 
-          2) self.getPositionDistribution(gameState)
-              This method uses the ghost agent to determine what positions the
-              ghost will move to from the provided gameState.  The ghost must be
-              placed in the gameState with a call to self.setGhostPosition
-              above.
+class GhostTransitions(object):
+    """
+    The motion model of a ghost as a sparse transition matrix over the ids
+    of legalPositions, id len(legalPositions) standing for the ghost's jail.
+    A captured ghost stays in jail, and moves off the legal positions are
+    dropped.  Matrices are cached under the ghost's transitionKey of the
+    state, and rebuilt every time for ghosts that have none.
+    """
+    CACHE_SIZE = 1024
 
-        It is worthwhile, however, to understand why these two helper methods
-        are used and how they combine to give us a belief distribution over new
-        positions after a time update from a particular position.
+    def __init__(self, ghostAgent, legalPositions):
+        self.ghostAgent = ghostAgent
+        self.legalPositions = legalPositions
+        self.positionIds = dict((p, i) for i, p in enumerate(legalPositions))
+        self.jailId = len(legalPositions)
+        self.matrices = {}
+        self.samplers = {}
+
+    def getKey(self, gameState):
+        "The ghost's transitionKey of gameState, or None if its transitions cannot be cached"
+        transitionKey = getattr(self.ghostAgent, 'transitionKey', None)
+        if transitionKey is None:
+            return None
+        return transitionKey(gameState)
+
+    def getCached(self, cache, key, compute):
+        if key is None:
+            return compute()
+        if key not in cache:
+            if len(cache) >= GhostTransitions.CACHE_SIZE:
+                cache.clear()
+            cache[key] = compute()
+        return cache[key]
+
+    def getMatrix(self, gameState):
+        "The transitions as (sources, targets, probs) arrays, sorted by source"
+        return self.getCached(self.matrices, self.getKey(gameState),
+                              lambda: self.computeMatrix(gameState))
+
+    def computeMatrix(self, gameState):
+        sources, targets, probs = [], [], []
+        state = gameState.deepCopy()
+        index = self.ghostAgent.index
+        for source, oldPos in enumerate(self.legalPositions):
+            conf = game.Configuration(oldPos, game.Directions.STOP)
+            state.data.agentStates[index] = game.AgentState(conf, False)
+            for action, prob in list(getActionDistribution(self.ghostAgent, state).items()):
+                target = self.positionIds.get(game.Actions.getSuccessor(oldPos, action))
+                if target is None or prob == 0: continue
+                sources.append(source)
+                targets.append(target)
+                probs.append(prob)
+        sources.append(self.jailId)
+        targets.append(self.jailId)
+        probs.append(1.0)
+        return (np.array(sources, dtype=np.intp),
+                np.array(targets, dtype=np.intp),
+                np.array(probs))
+
+    def getSampler(self, gameState):
         """
-        "*** YOUR CODE HERE ***"
-        ##util.raiseNotDefined()
-
-    def getBeliefDistribution(self):
-        return self.beliefs
+        The transitions laid out for sampling: row s of the matrix covers the
+        interval [s, s + 1) of keys, split in proportion to its probabilities,
+        so the successor of a ghost at s is targets[searchsorted(keys, s + u)]
+        for u uniform in [0, 1).  Positions the ghost cannot leave stay put.
+        """
+        return self.getCached(self.samplers, self.getKey(gameState),
+                              lambda: self.computeSampler(gameState))
+
+    def computeSampler(self, gameState):
+        sources, targets, probs = self.getMatrix(gameState)
+        numPositions = self.jailId + 1
+        totals = np.bincount(sources, weights=probs, minlength=numPositions)
+        stuck = np.flatnonzero(totals == 0)
+        if len(stuck) > 0:
+            sources = np.concatenate((sources, stuck))
+            targets = np.concatenate((targets, stuck))
+            probs = np.concatenate((probs, np.ones(len(stuck))))
+            order = np.argsort(sources, kind='stable')
+            sources, targets, probs = sources[order], targets[order], probs[order]
+            totals[stuck] = 1.0
+        cumulative = np.cumsum(probs / totals[sources])
+        rowStarts = np.searchsorted(sources, np.arange(numPositions))
+        before = np.concatenate(([0.0], cumulative))[rowStarts]
+        keys = sources + cumulative - before[sources]
+        # Rounding must not push the end of a row into the next one
+        rowEnds = np.append(sources[1:] != sources[:-1], True)
+        keys[rowEnds] = sources[rowEnds] + 1
+        return keys, targets
+
+    def sample(self, ids, gameState, rng):
+        "Moves ghosts at the given position ids one step, returning the new ids"
+        keys, targets = self.getSampler(gameState)
+        choices = np.searchsorted(keys, ids + rng.random(len(ids)), side='right')
+        return targets[choices]
+
+def systematicResample(particles, weights, rng):
+    """
+    Draws len(particles) particles in proportion to weights (not all zero)
+    with a single uniform number: the draws are evenly spaced through the
+    cumulative weights, which keeps the variance of resampling low.
+    """
+    numParticles = len(particles)
+    cumulative = np.cumsum(weights)
+    points = (np.arange(numParticles) + rng.random()) * (cumulative[-1] / numParticles)
+    choices = np.minimum(np.searchsorted(cumulative, points, side='right'), numParticles - 1)
+    return particles[choices]
 
 class ParticleFilter(InferenceModule):
     """
     A particle filter for approximately tracking a single ghost.
 
-    Useful helper functions will include random.choice, which chooses an element
-    from a list uniformly at random, and util.sample, which samples a key from a
-    Counter by treating its values as probabilities.
+    The particles are an array of position ids: indices into
+    self.legalPositions, with len(self.legalPositions) for the ghost's
+    jail.  Observing weighs every particle at once and resamples them
+    systematically; elapsing moves every particle at once through the
+    ghost's GhostTransitions.  The cost of a step depends on the number of
+    particles, not on the size of the maze.
     """
 
     def __init__(self, ghostAgent, numParticles=300):
@@ -240,80 +347,70 @@ class ParticleFilter(InferenceModule):
     def setNumParticles(self, numParticles):
         self.numParticles = numParticles
 
-
     def initializeUniformly(self, gameState):
         """
-        Initializes a list of particles. Use self.numParticles for the number of
-        particles. Use self.legalPositions for the legal board positions where a
-        particle could be located.  Particles should be evenly (not randomly)
-        distributed across positions in order to ensure a uniform prior.
-
-        Note: the variable you store your particles in must be a list; a list is
-        simply a collection of unweighted variables (positions in this case).
-        Storing your particles as a Counter (where there could be an associated
-        weight with each position) is incorrect and may produce errors.
+        Spreads self.numParticles particles evenly (not randomly) over the
+        legal positions, to ensure a uniform prior.
         """
-        "*** YOUR CODE HERE ***"
+        self.positions = self.legalPositions + [self.getJailPosition()]
+        self.jailId = len(self.legalPositions)
+        self.distances = getManhattanMatrix(gameState.getWalls(), self.legalPositions)
+        self.transitions = GhostTransitions(self.ghostAgent, self.legalPositions)
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        self.resetParticles()
+
+    def resetParticles(self):
+        self.particles = np.resize(np.arange(len(self.legalPositions), dtype=np.intp), self.numParticles)
+        self.beliefs = None
 
     def observe(self, observation, gameState):
         """
-        Update beliefs based on the given distance observation. Make sure to
-        handle the special case where all particles have weight 0 after
-        reweighting based on observation. If this happens, resample particles
-        uniformly at random from the set of legal positions
-        (self.legalPositions).
-
-        A correct implementation will handle two special cases:
-          1) When a ghost is captured by Pacman, all particles should be updated
-             so that the ghost appears in its prison cell,
-             self.getJailPosition()
-
-             As before, you can check if a ghost has been captured by Pacman by
-             checking if it has a noisyDistance of None.
-
-          2) When all particles receive 0 weight, they should be recreated from
-             the prior distribution by calling initializeUniformly. The total
-             weight for a belief distribution can be found by calling totalCount
-             on a Counter object
-
-        util.sample(Counter object) is a helper method to generate a sample from
-        a belief distribution.
-
-        You may also want to use util.manhattanDistance to calculate the
-        distance between a particle and Pacman's position.
+        Update beliefs based on the given distance observation.  A captured
+        ghost (a noisyDistance of None) sends every particle to jail; if no
+        particle is consistent with the observation, they start over from
+        the uniform prior.
         """
         noisyDistance = observation
-        emissionModel = busters.getObservationDistribution(noisyDistance)
-        pacmanPosition = gameState.getPacmanPosition()
-        "*** YOUR CODE HERE ***"
-        ##util.raiseNotDefined()
+        self.beliefs = None
+        if noisyDistance is None:
+            self.particles = np.full(self.numParticles, self.jailId, dtype=np.intp)
+            return
+        weights = getParticleWeights(self.particles, noisyDistance, self.distances,
+                                     gameState.getPacmanPosition(), self.jailId)
+        if weights.sum() == 0:
+            self.resetParticles()
+        else:
+            self.particles = systematicResample(self.particles, weights, self.rng)
 
     def elapseTime(self, gameState):
-        """
-        Update beliefs for a time step elapsing.
-
-        As in the elapseTime method of ExactInference, you should use:
-
-          newPosDist = self.getPositionDistribution(self.setGhostPosition(gameState, oldPos))
-
-        to obtain the distribution over new positions for the ghost, given its
-        previous position (oldPos) as well as Pacman's current position.
-
-        util.sample(Counter object) is a helper method to generate a sample from
-        a belief distribution.
-        """
-        "*** YOUR CODE HERE ***"
-        ##util.raiseNotDefined()
+        "Moves every particle according to the ghost's motion model"
+        self.particles = self.transitions.sample(self.particles, gameState, self.rng)
+        self.beliefs = None
 
     def getBeliefDistribution(self):
         """
         Return the agent's current belief state, a distribution over ghost
-        locations conditioned on all evidence and time passage. This method
-        essentially converts a list of particles into a belief distribution (a
-        Counter object)
+        locations conditioned on all evidence and time passage, as a Counter
         """
-        "*** YOUR CODE HERE ***"
-       ## util.raiseNotDefined()
+        if self.beliefs is None:
+            self.beliefs = countParticles(self.particles, self.positions)
+        return self.beliefs
+
+def getParticleWeights(ids, noisyDistance, distances, pacmanPosition, jailId):
+    "The likelihood of a noisy distance for ghosts at the given position ids"
+    row = np.append(distances.getRow(pacmanPosition), 0)
+    weights = getEmissionArray(noisyDistance, distances.size)[row[ids]]
+    # A ghost with a reading is not in jail
+    weights[ids == jailId] = 0.0
+    return weights
+
+def countParticles(ids, positions):
+    "A Counter of the fraction of particles at each position"
+    counts = np.bincount(ids, minlength=len(positions))
+    beliefs = util.FastCounter()
+    for i in np.flatnonzero(counts):
+        beliefs[positions[i]] = float(counts[i]) / len(ids)
+    return beliefs
 
 class MarginalInference(InferenceModule):
     """
@@ -321,6 +418,9 @@ class MarginalInference(InferenceModule):
     about ghosts.
     """
 
+    def setNumParticles(self, numParticles):
+        jointInference.setNumParticles(numParticles)
+
     def initializeUniformly(self, gameState):
         "Set the belief state to an initial, prior value."
         if self.index == 1:
@@ -339,16 +439,19 @@ class MarginalInference(InferenceModule):
 
     def getBeliefDistribution(self):
         "Returns the marginal belief over a particular ghost by summing out the others."
-        jointDistribution = jointInference.getBeliefDistribution()
-        dist = util.Counter()
-        for t, prob in list(jointDistribution.items()):
-            dist[t[self.index - 1]] += prob
-        return dist
+        return jointInference.getMarginalDistribution(self.index - 1)
 
 class JointParticleFilter(object):
     """
     JointParticleFilter tracks a joint distribution over tuples of all ghost
     positions.
+
+    The particles are a (numParticles x numGhosts) array of position ids, as
+    in ParticleFilter: column i holds ghost i's positions, with id
+    len(legalPositions) for its jail.  The column of a ghost flagged
+    ignoresOtherGhosts is moved at once through its GhostTransitions; any
+    other ghost is moved, for each distinct particle, with the other ghosts
+    at that particle's positions.
     """
 
     def __init__(self, numParticles=600):
@@ -362,30 +465,22 @@ class JointParticleFilter(object):
         self.numGhosts = gameState.getNumAgents() - 1
         self.ghostAgents = []
         self.legalPositions = legalPositions
+        self.jailId = len(legalPositions)
+        self.distances = getManhattanMatrix(gameState.getWalls(), legalPositions)
+        self.transitions = []
+        self.rng = np.random.default_rng(random.getrandbits(64))
         self.initializeParticles()
 
     def initializeParticles(self):
         """
-        Initialize particles to be consistent with a uniform prior.
-
-        Each particle is a tuple of ghost positions. Use self.numParticles for
-        the number of particles. You may find the `itertools` package helpful.
-        Specifically, you will need to think about permutations of legal ghost
-        positions, with the additional understanding that ghosts may occupy the
-        same space. Look at the `itertools.product` function to get an
-        implementation of the Cartesian product.
-
-        Note: If you use itertools, keep in mind that permutations are not
-        returned in a random order; you must shuffle the list of permutations in
-        order to ensure even placement of particles across the board. Use
-        self.legalPositions to obtain a list of positions a ghost may occupy.
-
-        Note: the variable you store your particles in must be a list; a list is
-        simply a collection of unweighted variables (positions in this case).
-        Storing your particles as a Counter (where there could be an associated
-        weight with each position) is incorrect and may produce errors.
+        Initialize particles to be consistent with a uniform prior: every
+        ghost's positions are spread evenly over the legal positions, and
+        shuffled independently so that the tuples are spread over the board.
         """
-        "*** YOUR CODE HERE ***"
+        column = np.resize(np.arange(len(self.legalPositions), dtype=np.intp), self.numParticles)
+        self.particles = np.column_stack([self.rng.permutation(column) for i in range(self.numGhosts)])
+        self.particles = self.particles.reshape(self.numParticles, self.numGhosts)
+        self.beliefs = None
 
     def addGhostAgent(self, agent):
         """
@@ -393,6 +488,7 @@ class JointParticleFilter(object):
         different).
         """
         self.ghostAgents.append(agent)
+        self.transitions.append(GhostTransitions(agent, self.legalPositions))
 
     def getJailPosition(self, i):
         return (2 * i + 1, 1);
@@ -400,39 +496,29 @@ class JointParticleFilter(object):
     def observeState(self, gameState):
         """
         Resamples the set of particles using the likelihood of the noisy
-        observations.
-
-        To loop over the ghosts, use:
-
-          for i in range(self.numGhosts):
-            ...
-
-        A correct implementation will handle two special cases:
-          1) When a ghost is captured by Pacman, all particles should be updated
-             so that the ghost appears in its prison cell, position
-             self.getJailPosition(i) where `i` is the index of the ghost.
-
-             As before, you can check if a ghost has been captured by Pacman by
-             checking if it has a noisyDistance of None.
-
-          2) When all particles receive 0 weight, they should be recreated from
-             the prior distribution by calling initializeParticles. After all
-             particles are generated randomly, any ghosts that are eaten (have
-             noisyDistance of None) must be changed to the jail Position. This
-             will involve changing each particle if a ghost has been eaten.
-
-        self.getParticleWithGhostInJail is a helper method to edit a specific
-        particle. Since we store particles as tuples, they must be converted to
-        a list, edited, and then converted back to a tuple. This is a common
-        operation when placing a ghost in jail.
+        observations.  A captured ghost (a noisyDistance of None) is sent to
+        jail in every particle.  If no particle is consistent with the
+        observations, they start over from the uniform prior, with the
+        captured ghosts in jail.
         """
         pacmanPosition = gameState.getPacmanPosition()
         noisyDistances = gameState.getNoisyGhostDistances()
         if len(noisyDistances) < self.numGhosts:
             return
-        emissionModels = [busters.getObservationDistribution(dist) for dist in noisyDistances]
-
-        "*** YOUR CODE HERE ***"
+        self.beliefs = None
+
+        weights = np.ones(self.numParticles)
+        for i in range(self.numGhosts):
+            if noisyDistances[i] is not None:
+                weights *= getParticleWeights(self.particles[:, i], noisyDistances[i],
+                                              self.distances, pacmanPosition, self.jailId)
+        if weights.sum() == 0:
+            self.initializeParticles()
+        else:
+            self.particles = systematicResample(self.particles, weights, self.rng)
+        for i in range(self.numGhosts):
+            if noisyDistances[i] is None:
+                self.particles[:, i] = self.jailId
 
     def getParticleWithGhostInJail(self, particle, ghostIndex):
         """
@@ -444,63 +530,63 @@ class JointParticleFilter(object):
         return tuple(particle)
 
     def elapseTime(self, gameState):
+        "Samples each particle's next state based on its current state and the gameState."
+        columns = []
+        for i in range(self.numGhosts):
+            if getattr(self.ghostAgents[i], 'ignoresOtherGhosts', False):
+                columns.append(self.transitions[i].sample(self.particles[:, i], gameState, self.rng))
+            else:
+                columns.append(self.sampleGivenParticles(i, gameState))
+        self.particles = np.column_stack(columns).reshape(self.particles.shape)
+        self.beliefs = None
+
+    def sampleGivenParticles(self, i, gameState):
         """
-        Samples each particle's next state based on its current state and the
-        gameState.
-
-        To loop over the ghosts, use:
-
-          for i in range(self.numGhosts):
-            ...
-
-        Then, assuming that `i` refers to the index of the ghost, to obtain the
-        distributions over new positions for that single ghost, given the list
-        (prevGhostPositions) of previous positions of ALL of the ghosts, use
-        this line of code:
-
-          newPosDist = getPositionDistributionForGhost(
-             setGhostPositions(gameState, prevGhostPositions), i, self.ghostAgents[i]
-          )
-
-        Note that you may need to replace `prevGhostPositions` with the correct
-        name of the variable that you have used to refer to the list of the
-        previous positions of all of the ghosts, and you may need to replace `i`
-        with the variable you have used to refer to the index of the ghost for
-        which you are computing the new position distribution.
-
-        As an implementation detail (with which you need not concern yourself),
-        the line of code above for obtaining newPosDist makes use of two helper
-        functions defined below in this file:
-
-          1) setGhostPositions(gameState, ghostPositions)
-              This method alters the gameState by placing the ghosts in the
-              supplied positions.
-
-          2) getPositionDistributionForGhost(gameState, ghostIndex, agent)
-              This method uses the supplied ghost agent to determine what
-              positions a ghost (ghostIndex) controlled by a particular agent
-              (ghostAgent) will move to in the supplied gameState.  All ghosts
-              must first be placed in the gameState using setGhostPositions
-              above.
-
-              The ghost agent you are meant to supply is
-              self.ghostAgents[ghostIndex-1], but in this project all ghost
-              agents are always the same.
+        Ghost i's next position ids, drawn for each distinct particle from
+        the ghost's distribution with all the ghosts at the particle's
+        positions.  A ghost in jail, or with no move to a legal position,
+        stays put.
         """
-        newParticles = []
-        for oldParticle in self.particles:
-            newParticle = list(oldParticle) # A list of ghost positions
-            # now loop through and update each entry in newParticle...
-
-            "*** YOUR CODE HERE ***"
-
-            "*** END YOUR CODE HERE ***"
-            newParticles.append(tuple(newParticle))
-        self.particles = newParticles
+        rows, inverse = np.unique(self.particles, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        members = np.argsort(inverse, kind='stable')
+        ends = np.cumsum(np.bincount(inverse, minlength=len(rows)))
+        positions = [self.getPositions(k) for k in range(self.numGhosts)]
+        positionIds = self.transitions[i].positionIds
+        column = self.particles[:, i].copy()
+        state = gameState.deepCopy()
+        start = 0
+        for row, end in zip(rows, ends):
+            particles, start = members[start:end], end
+            if row[i] == self.jailId: continue
+            setGhostPositions(state, [positions[k][id] for k, id in enumerate(row)])
+            dist = getPositionDistributionForGhost(state, i, self.ghostAgents[i])
+            moves = [(positionIds[pos], prob) for pos, prob in dist.items() if pos in positionIds and prob > 0]
+            if not moves: continue
+            targets = np.array([target for target, prob in moves], dtype=np.intp)
+            cumulative = np.cumsum([prob for target, prob in moves])
+            choices = np.searchsorted(cumulative, self.rng.random(len(particles)) * cumulative[-1], side='right')
+            column[particles] = targets[np.minimum(choices, len(targets) - 1)]
+        return column
+
+    def getPositions(self, i):
+        "Ghost i's position of each id"
+        return self.legalPositions + [self.getJailPosition(i)]
+
+    def getMarginalDistribution(self, i):
+        "The distribution of ghost i's position, as a Counter"
+        return countParticles(self.particles[:, i], self.getPositions(i))
 
     def getBeliefDistribution(self):
-        "*** YOUR CODE HERE ***"
-        util.raiseNotDefined()
+        "The joint distribution of the ghosts' positions, as a Counter of tuples"
+        if self.beliefs is None:
+            positions = [self.getPositions(i) for i in range(self.numGhosts)]
+            self.beliefs = util.FastCounter()
+            rows, counts = np.unique(self.particles, axis=0, return_counts=True)
+            for row, count in zip(rows, counts):
+                particle = tuple(positions[i][id] for i, id in enumerate(row))
+                self.beliefs[particle] = float(count) / self.numParticles
+        return self.beliefs
 
 # One JointInference module is shared globally across instances of MarginalInference
 jointInference = JointParticleFilter()
@@ -512,13 +598,23 @@ def getPositionDistributionForGhost(gameState, ghostIndex, agent):
     """
     # index 0 is pacman, but the students think that index 0 is the first ghost.
     ghostPosition = gameState.getGhostPosition(ghostIndex+1)
-    actionDist = agent.getDistribution(gameState)
-    dist = util.Counter()
+    actionDist = getActionDistribution(agent, gameState)
+    dist = util.FastCounter()
     for action, prob in list(actionDist.items()):
         successorPosition = game.Actions.getSuccessor(ghostPosition, action)
         dist[successorPosition] = prob
     return dist
 
+def getActionDistribution(agent, gameState):
+    """
+    The distribution over the actions of a ghost agent.  An empty one means
+    the ghost stops, as in GhostAgent.getAction (e.g. StaticGhost).
+    """
+    actionDist = agent.getDistribution(gameState)
+    if len(actionDist) == 0:
+        actionDist = {game.Directions.STOP: 1.0}
+    return actionDist
+
 def setGhostPositions(gameState, ghostPositions):
     "Sets the position of all ghosts to the values in ghostPositionTuple."
     for index, pos in enumerate(ghostPositions):
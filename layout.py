@@ -6,6 +6,7 @@ from builtins import range
 from builtins import object
 from util import manhattanDistance
 from game import Grid
+from game import Actions
 import os
 import random
 from functools import reduce
@@ -27,6 +28,7 @@ class Layout(object):
         self.numGhosts = 0
         self.processLayoutText(layoutText)
         self.layoutText = layoutText
+        self.legalActions, self.legalActionMasks = Actions.getLegalActionTable(self.walls)
         # self.initializeVisibilityMatrix()
 
     def getNumGhosts(self):
@@ -35,6 +35,7 @@ from game import GameStateData
 from game import Game
 from game import Directions
 from game import Actions
+from game import Configuration
 from util import nearestPoint
 from util import manhattanDistance
 import util, layout
@@ -104,7 +105,7 @@ class GameState(object):
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
         else:
-            GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+            GhostRules.decrementTimer( state.data.getWritableAgentState(agentIndex) )
 
         # Resolve multi-agent effects
         GhostRules.checkDeath( state, agentIndex )
@@ -211,7 +212,7 @@ class GameState(object):
         """
         Generates a new state by copying information from its predecessor.
         """
-        if prevState != None: # Initial state
+        if prevState is not None: # Initial state
             self.data = GameStateData(prevState.data)
         else:
             self.data = GameStateData()
@@ -258,8 +259,13 @@ class ClassicGameRules(object):
     These game rules manage the control flow of a game, deciding when
     and how the game starts and ends.
     """
-    def __init__(self, timeout=30):
+    def __init__(self, timeout=30, moveTimeout=None):
+        """
+        timeout is the time in seconds an agent may spend in a game, and
+        moveTimeout (if given) the limit on a single move, e.g. 0.05.
+        """
         self.timeout = timeout
+        self.moveTimeout = moveTimeout
 
     def newGame( self, layout, pacmanAgent, ghostAgents, display, quiet = False, catchExceptions=False):
         agents = [pacmanAgent] + ghostAgents[:layout.getNumGhosts()]
@@ -302,9 +308,11 @@ class ClassicGameRules(object):
         return self.timeout
 
     def getMoveWarningTime(self, agentIndex):
-        return self.timeout
+        return self.getMoveTimeout(agentIndex)
 
     def getMoveTimeout(self, agentIndex):
+        if self.moveTimeout is not None:
+            return self.moveTimeout
         return self.timeout
 
     def getMaxTimeWarnings(self, agentIndex):
@@ -321,7 +329,7 @@ class PacmanRules(object):
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+        return Actions.getPossibleActions( state.data.agentStates[0].configuration, state.data.layout.walls )
     getLegalActions = staticmethod( getLegalActions )
 
     def applyAction( state, action ):
@@ -332,7 +340,7 @@ class PacmanRules(object):
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.getWritableAgentState(0)
 
         # Update Configuration
         vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
@@ -361,11 +369,11 @@ class PacmanRules(object):
                 state.data._win = True
         # Eat capsule
         if( position in state.getCapsules() ):
-            state.data.capsules.remove( position )
+            state.data.capsules = [capsule for capsule in state.data.capsules if capsule != position]
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range( 1, len( state.data.agentStates ) ):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.getWritableAgentState(index).scaredTimer = SCARED_TIME
     consume = staticmethod( consume )
 
 class GhostRules(object):
@@ -394,7 +402,7 @@ class GhostRules(object):
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.getWritableAgentState(ghostIndex)
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0: speed /= 2.0
         vector = Actions.directionToVector( action, speed )
@@ -404,7 +412,9 @@ class GhostRules(object):
     def decrementTimer( ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint( ghostState.configuration.pos )
+            # Configurations are shared between states, so replace it
+            configuration = ghostState.configuration
+            ghostState.configuration = Configuration( nearestPoint( configuration.pos ), configuration.direction )
         ghostState.scaredTimer = max( 0, timer - 1 )
     decrementTimer = staticmethod( decrementTimer )
 
@@ -426,9 +436,11 @@ class GhostRules(object):
     def collide( state, ghostState, agentIndex):
         if ghostState.scaredTimer > 0:
             state.data.scoreChange += 200
+            ghostState = state.data.getWritableAgentState(agentIndex)
             GhostRules.placeGhost(state, ghostState)
             ghostState.scaredTimer = 0
             # Added for first-person
+            state.data._eaten = state.data._eaten[:]
             state.data._eaten[agentIndex] = True
         else:
             if not state.data._win:
@@ -502,7 +514,9 @@ def readCommand( argv ):
     parser.add_option('-r', '--recordActions', action='store_true', dest='record',
                       help='Writes game histories to a file (named by the time they were played)', default=False)
     parser.add_option('--replay', dest='gameToReplay',
-                      help='A recorded game file (pickle) to replay', default=None)
+                      help='A recorded game file to replay', default=None)
+    parser.add_option('--replayFrom', dest='replayFrom', type='int',
+                      help=default('The move to start showing a replayed game from'), default=0)
     parser.add_option('-a','--agentArgs',dest='agentArgs',
                       help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
     parser.add_option('-x', '--numTraining', dest='numTraining', type='int',
@@ -511,8 +525,12 @@ def readCommand( argv ):
                       help=default('Time to delay between frames; <0 means keyboard'), default=0.1)
     parser.add_option('-c', '--catchExceptions', action='store_true', dest='catchExceptions',
                       help='Turns on exception handling and timeouts during games', default=False)
-    parser.add_option('--timeout', dest='timeout', type='int',
+    parser.add_option('--timeout', dest='timeout', type='float',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('--moveTimeout', dest='moveTimeout', type='float',
+                      help='Maximum length of time in seconds an agent can spend on a single move (with -c)', default=None)
+    parser.add_option('--workers', dest='workers', type='int',
+                      help=default('Number of processes playing the training episodes, sharing one Q-table'), default=1)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
@@ -560,16 +578,28 @@ def readCommand( argv ):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    args['moveTimeout'] = options.moveTimeout
+    args['workers'] = options.workers
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
         print('Replaying recorded game %s.' % options.gameToReplay)
-        import pickle
-        f = open(options.gameToReplay)
-        try: recorded = pickle.load(f)
-        finally: f.close()
+        import gameRecorder
+        if gameRecorder.isRecording(options.gameToReplay):
+            recording = gameRecorder.GameRecording(options.gameToReplay, args['layout'])
+            # Play on from the last snapshot before the first move shown
+            snapshotMove, stateData = recording.getSnapshot(options.replayFrom)
+            recorded = {'layout': recording.layout, 'actions': recording.iterMoves(snapshotMove),
+                        'startState': stateData}
+            options.replayFrom -= snapshotMove
+        else:
+            # Games recorded as pickles by older versions
+            import pickle
+            f = open(options.gameToReplay, 'rb')
+            try: recorded = pickle.load(f)
+            finally: f.close()
         recorded['display'] = args['display']
-        replayGame(**recorded)
+        replayGame(startMove=options.replayFrom, **recorded)
         sys.exit(0)
 
     return args
@@ -597,12 +627,25 @@ def loadAgent(pacman, nographics):
                 return getattr(module, pacman)
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
-def replayGame( layout, actions, display ):
+def replayGame( layout, actions, display, startMove=0, startState=None ):
+    """
+    Replays a game from its moves, an iterable of (agentIndex, action).  The
+    first startMove moves are played without drawing them.  The moves are
+    played from startState, a GameStateData, when given (see
+    gameRecorder.GameRecording.getSnapshot) and from the start otherwise.
+    """
     import pacmanAgents, ghostAgents
     rules = ClassicGameRules()
     agents = [pacmanAgents.GreedyAgent()] + [ghostAgents.RandomGhost(i+1) for i in range(layout.getNumGhosts())]
     game = rules.newGame( layout, agents[0], agents[1:], display )
     state = game.state
+    if startState is not None:
+        state.data = startState
+    actions = iter(actions)
+    for move in range(startMove):
+        action = next(actions, None)
+        if action is None: break
+        state = state.generateSuccessor( *action )
     display.initialize(state.data)
 
     for action in actions:
@@ -615,11 +658,20 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
-def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
+def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, moveTimeout=None, workers=1 ):
     import __main__
     __main__.__dict__['_display'] = display
 
-    rules = ClassicGameRules(timeout)
+    if workers > 1 and numTraining > 0:
+        # Play the training episodes in parallel, then the rest in here
+        import parallelTraining, textDisplay
+        parallelTraining.runGamesInWorkers(runGames, workers, numTraining, pacman, layout=layout, ghosts=ghosts,
+                                           display=textDisplay.NullGraphics(), record=False, numTraining=numTraining,
+                                           catchExceptions=catchExceptions, timeout=timeout, moveTimeout=moveTimeout)
+        numGames -= numTraining
+        numTraining = 0
+
+    rules = ClassicGameRules(timeout, moveTimeout)
     games = []
 
     for i in range( numGames ):
@@ -633,16 +685,24 @@ def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0
             gameDisplay = display
             rules.quiet = False
         game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
-        game.run()
-        if not beQuiet: games.append(game)
-
         if record:
-            import time, pickle
+            # Moves are streamed to the recording as the game runs
+            import time, gameRecorder
             fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            pickle.dump(components, f)
-            f.close()
+            recorder = gameRecorder.GameRecorder(fname, layout)
+            game.moveHistory = gameRecorder.MoveHistory(recorder, game)
+            try:
+                game.run()
+            finally:
+                game.moveHistory.flush()
+                recorder.close()
+        else:
+            game.run()
+        if not beQuiet: games.append(game)
+
+    # Learning agents write their qtable out once the games are over
+    if hasattr(pacman, 'writeQtable'):
+        pacman.writeQtable()
 
     if (numGames-numTraining) > 0:
         scores = [game.state.getScore() for game in games]
@@ -0,0 +1,112 @@
+# parallelTraining.py
+# -------------------
+
+"""
+Plays training games in several worker processes that share one Q-table.
+
+Before the workers are forked, a learning agent's Q-table is moved to a
+memory-mapped binary file (see qtableStores.py).  The mapping is shared, so
+every worker applies its TD updates straight into the same table as the
+others, without locks: concurrent updates to the same entry may
+occasionally overwrite each other, which Q-learning tolerates well.  Once
+all the workers are done the table is copied back into the agent's
+original store.
+
+Each worker runs its own Game instances with a null display, so wall-clock
+training time scales with the number of cores.  Workers are forked, which
+means this is only available on platforms that support fork(); elsewhere
+the games are simply played in the current process.
+"""
+
+from __future__ import print_function
+import multiprocessing, random, sys
+from queue import Empty
+
+# Seconds between checks on the workers while waiting for their results
+POLL_INTERVAL = 1.0
+
+def runGamesInWorkers(runGames, workers, numGames, pacman, **args):
+    """
+    Plays numGames games split across `workers` processes, each one calling
+    runGames(pacman=pacman, numGames=<its share>, **args).  If args has a
+    numTraining entry it is set to the share as well, so that every game a
+    worker plays is a training game.
+
+    Returns the (score, isWin) pairs of the games returned by each runGames.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print('Parallel training needs fork(); playing the games in this process', file=sys.stderr)
+        workers = 1
+    shares = [numGames // workers + (1 if i < numGames % workers else 0) for i in range(workers)]
+    shares = [share for share in shares if share > 0]
+    if len(shares) <= 1:
+        if 'numTraining' in args: args['numTraining'] = numGames
+        games = runGames(pacman=pacman, numGames=numGames, **args)
+        return [(game.state.getScore(), game.state.isWin()) for game in games]
+
+    replaced = pacman.shareQtable() if hasattr(pacman, 'shareQtable') else None
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = []
+    try:
+        for share in shares:
+            workerArgs = dict(args)
+            if 'numTraining' in workerArgs: workerArgs['numTraining'] = share
+            process = context.Process(target=playShare,
+                                      args=(runGames, pacman, share, random.getrandbits(32), results, workerArgs))
+            process.start()
+            processes.append(process)
+        scores = collectResults(processes, results, pacman)
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+        if hasattr(pacman, 'unshareQtable'):
+            pacman.unshareQtable(replaced)
+    countEpisodes(pacman, numGames)
+    return scores
+
+def playShare(runGames, pacman, numGames, seed, results, args):
+    "Body of a worker process: plays its share of the games"
+    random.seed(seed)
+    # Only the parent process writes checkpoints
+    checkpointer = getattr(pacman, 'checkpointer', None)
+    if checkpointer is not None:
+        checkpointer.everyEpisodes = 0
+        checkpointer.everySeconds = 0
+    games = runGames(pacman=pacman, numGames=numGames, **args)
+    results.put([(game.state.getScore(), game.state.isWin()) for game in games])
+
+def collectResults(processes, results, pacman):
+    """
+    Waits for every worker to report its games, checkpointing the shared
+    table in the meantime when the agent asks for time-based checkpoints.
+    """
+    checkpointer = getattr(pacman, 'checkpointer', None)
+    scores = []
+    remaining = len(processes)
+    while remaining > 0:
+        try:
+            scores.extend(results.get(timeout=POLL_INTERVAL))
+            remaining -= 1
+        except Empty:
+            crashed = [process for process in processes if process.exitcode not in (None, 0)]
+            if crashed:
+                raise Exception('Training worker %d exited with code %d' % (crashed[0].pid, crashed[0].exitcode))
+            if checkpointer is not None and checkpointer.everySeconds > 0:
+                checkpointer.maybeCheckpoint(pacman.episodesSoFar)
+    return scores
+
+def countEpisodes(agent, numEpisodes):
+    """
+    Credits the episodes played by the workers to the parent's agent, taking
+    off the training wheels as ReinforcementAgent.stopEpisode would.
+    """
+    if not hasattr(agent, 'episodesSoFar'): return
+    agent.episodesSoFar += numEpisodes
+    if agent.episodesSoFar >= agent.numTraining:
+        agent.epsilon = 0.0
+        agent.alpha = 0.0
@@ -5,7 +5,10 @@ from game import *
 from learningAgents import ReinforcementAgent
 from featureExtractors import *
 
-import random,util,math
+import random,util,math,os,atexit
+import numpy as np
+import qtableStores
+import replayBuffer
 
 class QLearningAgent(ReinforcementAgent):
     """
@@ -19,35 +22,106 @@ class QLearningAgent(ReinforcementAgent):
         - self.alpha (learning rate)
         - self.discount (discount rate)
     """
-    def __init__(self, **args):
-        "Initialize Q-values"
+    def __init__(self, qtable="qtable.txt", checkpointDir=None, checkpointEvery=100,
+                 checkpointSeconds=60, replaySize=0, replayBatch=32, replayPriority=0.0,
+                 maxStates=65536, eviction=None, **args):
+        """
+        Initialize Q-values
+
+        qtable - file holding the Q-table. A .txt file is read as text, any
+                 other name is opened as a memory-mapped binary table (see
+                 qtableStores.py), imported from the .txt file with the same
+                 name the first time it is used.  A .qhash file is a sparse
+                 table whose rows are only created for the visited states.
+        checkpointDir     - directory for the periodic Q-table checkpoints
+                            (<qtable>.checkpoints by default)
+        checkpointEvery   - episodes between checkpoints (0 disables)
+        checkpointSeconds - seconds between checkpoints (0 disables)
+        replaySize     - transitions kept for experience replay (0 disables)
+        replayBatch    - transitions replayed after each update
+        replayPriority - exponent of the TD error when sampling the replayed
+                         transitions (0 samples them uniformly)
+        maxStates - states held by a .qhash table
+        eviction  - what a full .qhash table drops to make room: 'lru' (the
+                    least recently used states) or 'lfu' (the least visited);
+                    None raises an exception instead.  Replayed transitions
+                    of evicted states update whichever state took their row.
+
+        If checkpoints were taken after the qtable was last closed (the
+        previous run crashed before closing it), training resumes from the
+        newest one.
+        The qtable is written back by close(), which also runs at exit.
+        """
         ReinforcementAgent.__init__(self, **args)
 
-        self.actions = {"north":0, "east":1, "south":2, "west":3, "exit":4}
-        self.table_file = open("qtable.txt", "r+")      
+        self.qtable_path = qtable
+        self.maxStates = int(maxStates)
+        self.eviction = eviction
         self.q_table = self.readQtable()
+        self.checkpointer = qtableStores.QTableCheckpointer(self.q_table, checkpointDir,
+                                                           checkpointEvery, checkpointSeconds)
+        resumed = self.checkpointer.resume()
+        if resumed:
+            print('Resuming Q-table from checkpoint %s' % resumed)
+        self.closed = False
+        atexit.register(self.close)
+        # Contiguous (states x actions) array shared with the store
+        self.q_values = self.q_table.values
+        self.setActions({"north":0, "east":1, "south":2, "west":3, "exit":4})
         self.epsilon = 1
+        self.replaySize = int(replaySize)
+        self.replayBatch = int(replayBatch)
+        self.replayPriority = float(replayPriority)
+        self.replay = None
+
+    def setActions(self, actions):
+        "Set the mapping from action names to qtable columns"
+        self.actions = actions
+        self.actionNames = sorted(actions, key=actions.get)
+        self.legalMasks = {}
+        self.replay = None
 
     def readQtable(self):
-        "Read qtable from disc"
-        table = self.table_file.readlines()
-        q_table = []
-
-        for i, line in enumerate(table):
-            row = line.split()
-            row = [float(x) for x in row]
-            q_table.append(row)
-
-        return q_table
+        "Open the qtable store from disc"
+        return qtableStores.openQTable(self.qtable_path, maxStates=self.maxStates, eviction=self.eviction)
 
     def writeQtable(self):
         "Write qtable to disc"
-        self.table_file.seek(0)
-        self.table_file.truncate()
-        for line in self.q_table:
-            for item in line:
-                self.table_file.write(str(item)+" ")
-            self.table_file.write("\n")
+        self.q_table.flush()
+
+    def setQtable(self, store):
+        "Switch the agent over to another qtable store"
+        self.q_table = store
+        self.q_values = store.values
+        self.checkpointer.store = store
+
+    def shareQtable(self):
+        """
+        Move the qtable to a memory-mapped binary file, so that processes
+        forked from this one update the very same table.  Returns the store
+        it replaced, to be handed back to unshareQtable, or None if the
+        table already was memory-mapped.  Hashed tables cannot be shared.
+        """
+        if isinstance(self.q_table, qtableStores.MmapQTableStore):
+            return None
+        if isinstance(self.q_table, qtableStores.HashedQTableStore):
+            raise Exception("Hashed Q-tables cannot be shared between processes")
+        store = self.q_table
+        path = os.path.splitext(store.path)[0] + ".shared.bin"
+        qtableStores.writeBinaryQTable(path, store.values)
+        self.setQtable(qtableStores.MmapQTableStore(path))
+        return store
+
+    def unshareQtable(self, store):
+        "Copy the shared qtable back into the store replaced by shareQtable"
+        if store is None:
+            return
+        shared = self.q_table
+        store.values[:] = shared.values
+        self.setQtable(store)
+        shared.close()
+        os.remove(shared.path)
+        store.flush()
 
     # def printQtable(self):
     #     "Print qtable"
@@ -55,10 +129,22 @@ class QLearningAgent(ReinforcementAgent):
     #         print(line)
     #     print("\n")    
             
-    def __del__(self):
-        "Destructor. Invokation at the end of each episode"
-        self.writeQtable()
-        self.table_file.close()
+    def final(self, state):
+        "Called at the terminal state; checkpoints the qtable when it is due"
+        ReinforcementAgent.final(self, state)
+        if self.checkpointer.isEnabled():
+            self.checkpointer.maybeCheckpoint(self.episodesSoFar)
+
+    def close(self):
+        "Waits for pending checkpoints and closes the qtable"
+        if self.closed: return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.checkpointer.close()
+        self.q_values = None
+        self.q_table.close()
+        # The table on disc is now newer than any of its checkpoints
+        self.checkpointer.markClean()
 
     def computePosition(self, state):
         """
@@ -67,6 +153,27 @@ class QLearningAgent(ReinforcementAgent):
         """
         return state[0]+state[1]*4
 
+    def getLegalMask(self, legalActions):
+        "Boolean mask over the qtable columns of the given legal actions"
+        key = tuple(legalActions)
+        mask = self.legalMasks.get(key)
+        if mask is None:
+            mask = np.zeros(len(self.actionNames), dtype=bool)
+            for action in legalActions:
+                mask[self.actions[action]] = True
+            self.legalMasks[key] = mask
+        return mask
+
+    def encodeState(self, state):
+        """
+        Returns the qtable row of a state together with the mask of its
+        legal columns, or (None, None) if there are no legal actions.
+        """
+        legalActions = self.getLegalActions(state)
+        if len(legalActions) == 0:
+            return None, None
+        return self.q_table.getRow(self.computePosition(state)), self.getLegalMask(legalActions)
+
     def getQValue(self, state, action):
 
         """
@@ -74,7 +181,7 @@ class QLearningAgent(ReinforcementAgent):
           Should return 0.0 if we have never seen a state
           or the Q node value otherwise
         """
-        position = self.computePosition(state)
+        position = self.q_table.getRow(self.computePosition(state))
         action_column = self.actions[action]
 
         return self.q_table[position][action_column]
@@ -86,10 +193,10 @@ class QLearningAgent(ReinforcementAgent):
           there are no legal actions, which is the case at the
           terminal state, you should return a value of 0.0.
         """
-        legalActions = self.getLegalActions(state)
-        if len(legalActions)==0:
+        position, mask = self.encodeState(state)
+        if mask is None:
           return 0
-        return max(self.q_table[self.computePosition(state)])
+        return np.where(mask, self.q_values[position], -np.inf).max()
 
     def computeActionFromQValues(self, state):
         """
@@ -97,21 +204,14 @@ class QLearningAgent(ReinforcementAgent):
           are no legal actions, which is the case at the terminal state,
           you should return None.
         """
-        legalActions = self.getLegalActions(state)
-        if len(legalActions)==0:
+        position, mask = self.encodeState(state)
+        if mask is None:
           return None
 
-        best_actions = [legalActions[0]]
-        best_value = self.getQValue(state, legalActions[0])
-        for action in legalActions:
-            value = self.getQValue(state, action)
-            if value == best_value:
-                best_actions.append(action)
-            if value > best_value:
-                best_actions = [action]
-                best_value = value
-        
-        return random.choice(best_actions)
+        # Ties between the best legal actions are broken at random
+        values = np.where(mask, self.q_values[position], -np.inf)
+        best_columns = np.flatnonzero(values == values.max())
+        return self.actionNames[random.choice(best_columns)]
 
     def getAction(self, state):
         """
@@ -158,17 +258,50 @@ class QLearningAgent(ReinforcementAgent):
         # -> row = distance
         # -> column = action
         
-        position = self.computePosition(state)
+        position = self.q_table.getRow(self.computePosition(state))
         action_column = self.actions[action]
 
-        old_q_value = (1 - self.alpha) * self.getQValue(state, action)
+        old_q_value = (1 - self.alpha) * self.q_values[position, action_column]
         if len(self.getLegalActions(state)) == 0: # terminal state
             new_value = self.alpha * reward
         else: # non-terminal state
             new_value = self.alpha * \
                          (reward + self.discount * self.computeValueFromQValues(nextState))
 
-        self.q_table[position][action_column] = old_q_value + new_value
+        self.q_values[position, action_column] = old_q_value + new_value
+
+        if self.replaySize > 0 and self.alpha > 0:
+            nextPosition, nextMask = self.encodeState(nextState)
+            self.getReplayBuffer().add(position, action_column, reward, nextPosition, nextMask)
+            self.replayTransitions()
+
+    def getReplayBuffer(self):
+        "The experience replay buffer, created for the current actions"
+        if self.replay is None:
+            self.replay = replayBuffer.ReplayBuffer(self.replaySize, len(self.actionNames), self.replayPriority)
+            self.replayRandom = np.random.default_rng(random.getrandbits(64))
+        return self.replay
+
+    def replayTransitions(self):
+        """
+        Replays a minibatch of stored transitions as one vectorized TD
+        update.  Transitions drawn more than once share a single step.
+        """
+        buffer = self.replay
+        if len(buffer) < self.replayBatch:
+            return
+        batch = buffer.sample(self.replayBatch, self.replayRandom)
+        rows, columns = buffer.rows[batch], buffer.columns[batch]
+        nextRows, nextMasks = buffer.nextRows[batch], buffer.nextMasks[batch]
+
+        nextValues = np.where(nextMasks, self.q_values[nextRows], -np.inf).max(axis=1)
+        nextValues[nextRows < 0] = 0.0
+        errors = buffer.rewards[batch] + self.discount * nextValues - self.q_values[rows, columns]
+
+        cells = rows * len(self.actionNames) + columns
+        repeats = np.bincount(cells)[cells]
+        np.add.at(self.q_values, (rows, columns), self.alpha * errors / repeats)
+        buffer.updatePriorities(batch, errors)
 
     def getPolicy(self, state):
         "Return the best action in the qtable for a given state"
@@ -180,10 +313,15 @@ class QLearningAgent(ReinforcementAgent):
 
 class PacmanQAgent(QLearningAgent):
     "Exactly the same as QLearningAgent, but with different default parameters"
+    # Game.run hands the winning state to observationFunction, to learn from the last move
+    observeWinningState = True
+
     # pillar la distancia al fantasma más cercano e ir a por el hasta que nos lo comamos
 
     # fantasmas vivos
-    def __init__(self, epsilon=0,gamma=0.8,alpha=0.5, ghostAgents = None, numTraining=0, **args):
+    ENCODINGS = ("basic", "extended")
+
+    def __init__(self, epsilon=0,gamma=0.8,alpha=0.5, ghostAgents = None, numTraining=0, encoding="basic", **args):
         """
         These default parameters can be changed from the pacman.py command line.
         For example, to change the exploration rate, try:
@@ -193,7 +331,14 @@ class PacmanQAgent(QLearningAgent):
         epsilon  - exploration rate
         gamma    - discount factor
         numTraining - number of training episodes, i.e. no learning after these many episodes
+        encoding - 'basic' codes a state by its legal actions and the direction
+                   to the nearest ghost; 'extended' adds the distance to that
+                   ghost and the number of living ghosts, and is meant for a
+                   .qhash table
         """
+        if encoding not in PacmanQAgent.ENCODINGS:
+            raise Exception("Unknown state encoding %s" % encoding)
+        self.encoding = encoding
         QLearningAgent.__init__(self, **args)
 
         args['epsilon'] = epsilon
@@ -208,7 +353,16 @@ class PacmanQAgent(QLearningAgent):
 
         self.nearestGhostIdx = None
 
-        self.actions = {"North":0, "East":1, "South":2, "West":3, "Stop":4}
+        self.setActions({"North":0, "East":1, "South":2, "West":3, "Stop":4})
+        # Code of each legal move in the qtable row and the mask of legal
+        # columns for every combination of codes (Stop is always legal).
+        # These are the bits of the layout's legalActionMasks.
+        self.legalActionCodes = {"North":1, "South":2, "East":4, "West":8}
+        self.legalCodeMasks = np.zeros((16, len(self.actions)), dtype=bool)
+        for code in range(16):
+            for action, bit in self.legalActionCodes.items():
+                self.legalCodeMasks[code, self.actions[action]] = bool(code & bit)
+            self.legalCodeMasks[code, self.actions["Stop"]] = True
 
         # distance items: [start_distance, final_distance]
         self.distances = [
@@ -293,26 +447,34 @@ class PacmanQAgent(QLearningAgent):
 
     def computePosition(self, state):
         """
-        Compute the row of the qtable for a given state.
+        Compute the code of a given state, which is its row of a dense qtable.
 
         Args:
             state: (x,y) position of the pacman
         """
+        return self.computeStateCode(state)[0]
+
+    def encodeState(self, state):
+        """
+        Compute the row of the qtable for a given state and the mask of its
+        legal columns, looking the legal actions up only once.
+        """
+        if state.isWin() or state.isLose():
+            return None, None
+        position, value = self.computeStateCode(state)
+        return self.q_table.getRow(position), self.legalCodeMasks[value]
+
+    def computeStateCode(self, state):
+        "The code of a state together with the code of its legal actions"
         num_directions = 4
-        ghost_direction = state.getDirectionToNearestGhost(self.nearestGhostIdx)
 
-        legalActions = state.getLegalActions()
-        # we assume there will be always at least one legal action
-        value = 0
-        for action in legalActions:
-            if action == 'North':
-                value += 1
-            elif action == 'South':
-                value += 2
-            elif action == 'East':
-                value += 4
-            elif action == 'West':
-                value += 8
+        # The layout knows the code of every cell
+        value = state.data.layout.legalActionMasks.get(state.getPacmanPosition())
+        if value is None:
+            value = 0
+            for action in state.getLegalActions():
+                value += self.legalActionCodes.get(action, 0)
+        ghost_direction = state.getDirectionToNearestGhost(self.nearestGhostIdx)
         
         # directions = {
         #     "N": 1,
@@ -330,7 +492,31 @@ class PacmanQAgent(QLearningAgent):
         #     if livingGhost == True:
         #         living_value += 1
 
-        return (value - 1) * num_directions + ghost_direction - 1 # 112 + 8 - 1 = 119
+        position = (value - 1) * num_directions + ghost_direction - 1 # 112 + 8 - 1 = 119
+        if self.encoding == "extended":
+            position += self.numBasicStates() * self.computeExtendedCode(state)
+        return position, value
+
+    def numBasicStates(self):
+        "Codes of the basic encoding: 15 combinations of legal moves times 4 directions"
+        return 15 * 4
+
+    def computeExtendedCode(self, state):
+        "The distance bucket of the nearest ghost and the number of living ghosts, as one code"
+        distance = state.getDistanceNearestGhost(self.nearestGhostIdx)
+        bucket = len(self.distances)
+        for idx, (start, end) in enumerate(self.distances):
+            if start <= distance < end:
+                bucket = idx
+                break
+        livingGhosts = sum(1 for living in state.getLivingGhosts()[1:] if living)
+        return bucket + (len(self.distances) + 1) * livingGhosts
+
+    def numStates(self):
+        "Number of state codes of the encoding (with up to 4 ghosts)"
+        if self.encoding == "extended":
+            return self.numBasicStates() * (len(self.distances) + 1) * 5
+        return self.numBasicStates()
         
         # return ghost_direction - 1
         
@@ -344,7 +530,7 @@ class PacmanQAgent(QLearningAgent):
         num_living_ghosts = 5
 
         with open("qtable.ini.txt", "w", encoding="utf-8") as initTableFile:
-            for _ in range(num_directions * num_legal_actions):
+            for _ in range(self.numStates()):
             # for _ in range(num_directions):
                 line = "0.0 " * (num_actions - 1) + "0.0\n"
                 initTableFile.write(line)
@@ -358,3 +544,83 @@ class PacmanQAgent(QLearningAgent):
         action = QLearningAgent.getAction(self,state)
         self.doAction(state,action)
         return action
+
+class ApproximateQAgent(PacmanQAgent):
+    """
+       ApproximateQLearningAgent
+
+       Q(state,action) is the dot product of a weight vector with the
+       features of the extractor, so the agent only learns one weight per
+       feature, however many states it visits.  The weights are kept as a
+       single-row table in the qtable stores (weights.txt by default, or any
+       name openQTable accepts), so they are checkpointed like a Q-table.
+       Experience replay works on Q-table rows, so replaySize must stay 0.
+    """
+    def __init__(self, extractor='SimpleExtractor', weights="weights.txt", **args):
+        self.featExtractor = util.lookup(extractor, globals())()
+        if self.featExtractor.featureNames is None:
+            raise Exception("ApproximateQAgent needs an extractor with fixed features, not %s" % extractor)
+        if int(args.get('replaySize', 0)) > 0:
+            raise Exception("ApproximateQAgent does not support experience replay (replaySize)")
+        args['qtable'] = weights
+        PacmanQAgent.__init__(self, **args)
+
+    def readQtable(self):
+        "Open the weights, starting from zeros if there are none yet"
+        numFeatures = len(self.featExtractor.featureNames)
+        if self.qtable_path.endswith(".txt") and not os.path.exists(self.qtable_path):
+            qtableStores.writeTextQTable(self.qtable_path, [[0.0] * numFeatures])
+        store = qtableStores.openQTable(self.qtable_path)
+        if store.values.shape != (1, numFeatures):
+            raise Exception("%s does not hold the %d weights of the extractor" % (self.qtable_path, numFeatures))
+        return store
+
+    def writeInitQtable(self):
+        "There is no tabular qtable to initialise"
+        pass
+
+    def getWeights(self):
+        "The weights, a view of the row of the weights store"
+        return self.q_values[0]
+
+    def getQValue(self, state, action):
+        """
+          Should return Q(state,action) = w * featureVector
+          where * is the dotProduct operator
+        """
+        return float(np.dot(self.getWeights(), self.featExtractor.getFeatureVector(state, action)))
+
+    def getLegalQValues(self, state):
+        "The legal actions of a state and their Q-values, or None at the terminal state"
+        if state.isWin() or state.isLose():
+            return None, None
+        legalActions = self.getLegalActions(state)
+        if len(legalActions) == 0:
+            return None, None
+        # One matrix-vector product over the features of all the legal actions
+        features = self.featExtractor.getFeaturesBatch(state, legalActions)
+        return legalActions, features.dot(self.getWeights())
+
+    def computeValueFromQValues(self, state):
+        legalActions, values = self.getLegalQValues(state)
+        if legalActions is None:
+          return 0
+        return values.max()
+
+    def computeActionFromQValues(self, state):
+        legalActions, values = self.getLegalQValues(state)
+        if legalActions is None:
+          return None
+
+        # Ties between the best legal actions are broken at random
+        best = np.flatnonzero(values == values.max())
+        return legalActions[random.choice(best)]
+
+    def update(self, state, action, nextState, reward):
+        """
+           Should update your weights based on transition
+        """
+        features = self.featExtractor.getFeatureVector(state, action)
+        difference = reward + self.discount * self.computeValueFromQValues(nextState) - \
+                     float(np.dot(self.getWeights(), features))
+        self.getWeights()[:] += self.alpha * difference * features
@@ -0,0 +1,640 @@
+# qtableStores.py
+# ---------------
+
+"""
+Storage backends for the tabular Q-learning agents.
+
+A Q-table store holds the table as a contiguous 2-D NumPy array of float64
+values in store.values (states x actions), and also exposes its rows through
+store[row], so that store[row][column] reads or writes a single Q-value.  Two
+backends are available:
+
+  TextQTableStore - the original plain text format, one row per line.
+                    The whole file is parsed on load and rewritten on flush.
+
+  MmapQTableStore - a binary file holding a fixed header followed by the
+                    table as row-major float64 values.  The file is mapped
+                    into memory and store.values is a view over the mapping,
+                    so opening it is O(1) and flushing only writes back the
+                    pages that were touched.
+
+  HashedQTableStore - a sparse table (.qhash) for large state encodings,
+                    where a hash index maps state codes to rows created
+                    on first visit.
+
+Agents turn a state code into a row with store.getRow(code), which is the
+code itself for the dense backends.
+
+Use openQTable(path) to pick the backend from the file name.  Binary tables
+that do not exist yet are imported from the text table with the same name,
+so existing qtable.txt files keep working:
+
+  store = openQTable("qtable.bin")   # created from qtable.txt if missing
+  store[7][2] += 1.0
+  store.close()
+
+Every file is written to a temporary name and then renamed over the target,
+so a crash never leaves a half-written table behind.  QTableCheckpointer
+builds on that to snapshot a store periodically from a background thread.
+A snapshot file starts with a header naming the store format (dense or
+hashed) and the shape of the values, so that a store only ever restores
+snapshots of its own kind.
+"""
+
+from __future__ import print_function
+import atexit, mmap, os, struct, sys, threading, time
+import numpy as np
+
+# magic, version, header size, number of states, number of actions
+QTABLE_HEADER = struct.Struct('<4sHHII')
+QTABLE_MAGIC = b'QTAB'
+QTABLE_VERSION = 1
+# The header is padded so that the rows start on a cache line
+QTABLE_HEADER_SIZE = 64
+QTABLE_DTYPE = np.dtype('<f8')
+
+# magic, store format, rows and actions of the values
+SNAPSHOT_HEADER = struct.Struct('<4s8sII')
+SNAPSHOT_MAGIC = b'QSNP'
+
+def readTextQTable(path):
+    "Parses a text Q-table into a list of rows"
+    with open(path, "r") as tableFile:
+        return [[float(x) for x in line.split()] for line in tableFile if line.strip()]
+
+def replaceFile(path, write, mode="w"):
+    """
+    Calls write(file) on a temporary file next to path and atomically
+    renames it to path once its contents are on disc.  The temporary file
+    is removed if the write fails.
+    """
+    tmpPath = path + ".tmp"
+    try:
+        with open(tmpPath, mode) as tmpFile:
+            write(tmpFile)
+            tmpFile.flush()
+            os.fsync(tmpFile.fileno())
+        os.replace(tmpPath, path)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+def writeTextQTable(path, rows):
+    "Writes the rows of a Q-table in the text format"
+    def write(tableFile):
+        for row in rows:
+            for item in row:
+                tableFile.write(str(item) + " ")
+            tableFile.write("\n")
+    replaceFile(path, write)
+
+def writeBinaryQTable(path, values):
+    "Writes a (states x actions) array as a binary Q-table"
+    values = np.asarray(values, dtype=QTABLE_DTYPE)
+    numStates, numActions = values.shape
+    header = QTABLE_HEADER.pack(QTABLE_MAGIC, QTABLE_VERSION, QTABLE_HEADER_SIZE, numStates, numActions)
+    def write(tableFile):
+        tableFile.write(header.ljust(QTABLE_HEADER_SIZE, b'\0'))
+        tableFile.write(values.tobytes())
+    replaceFile(path, write, "wb")
+
+def readBinaryQTable(path):
+    "Returns a copy of the values of a binary Q-table"
+    store = MmapQTableStore(path)
+    try:
+        return store.values.copy()
+    finally:
+        store.close()
+
+def writeSnapshotFile(path, format, arrays):
+    """
+    Writes the arrays of a store snapshot, the values first, after a header
+    naming the store format and the (rows x actions) shape of the values
+    """
+    numRows, numActions = arrays[0].shape
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, format.encode('ascii'), numRows, numActions)
+    def write(snapshotFile):
+        snapshotFile.write(header)
+        for array in arrays:
+            np.save(snapshotFile, array, allow_pickle=False)
+    replaceFile(path, write, "wb")
+
+def readSnapshotHeader(snapshotFile):
+    "Returns the format and shape of the snapshot in a file, or None if it is not one"
+    header = snapshotFile.read(SNAPSHOT_HEADER.size)
+    if len(header) < SNAPSHOT_HEADER.size:
+        return None
+    magic, format, numRows, numActions = SNAPSHOT_HEADER.unpack(header)
+    if magic != SNAPSHOT_MAGIC:
+        return None
+    return format.rstrip(b'\0').decode('ascii'), (numRows, numActions)
+
+def readSnapshotFile(path):
+    "Returns the format, shape and arrays of a snapshot file"
+    with open(path, "rb") as snapshotFile:
+        header = readSnapshotHeader(snapshotFile)
+        if header is None:
+            raise Exception("Not a Q-table snapshot: " + path)
+        size = os.fstat(snapshotFile.fileno()).st_size
+        arrays = []
+        while snapshotFile.tell() < size:
+            arrays.append(np.load(snapshotFile, allow_pickle=False))
+    return header[0], header[1], arrays
+
+def loadSnapshot(store, path):
+    "The arrays of a snapshot for store, raising an exception if it is of another format or shape"
+    format, shape, arrays = readSnapshotFile(path)
+    if format != store.SNAPSHOT_FORMAT:
+        raise Exception("%s is a %s snapshot, not a %s one" % (path, format, store.SNAPSHOT_FORMAT))
+    if not store.fitsSnapshot(shape):
+        raise Exception("%s holds %d x %d values, which do not fit %s" % ((path,) + shape + (store.path,)))
+    return arrays
+
+class TextQTableStore(object):
+    """
+    A Q-table kept in memory as a NumPy array and stored as text.
+    """
+    SNAPSHOT_FORMAT = "dense"
+
+    def __init__(self, path):
+        self.path = path
+        rows = readTextQTable(path)
+        self.numStates = len(rows)
+        self.numActions = len(rows[0]) if rows else 0
+        self.values = np.array(rows, dtype=QTABLE_DTYPE).reshape(self.numStates, self.numActions)
+
+    def __getitem__(self, row):
+        return self.values[row]
+
+    def getRow(self, code):
+        return code
+
+    def snapshot(self):
+        return [self.values.copy()]
+
+    def fitsSnapshot(self, shape):
+        return tuple(shape) == self.values.shape
+
+    def restore(self, path):
+        self.values[:] = loadSnapshot(self, path)[0]
+
+    def __len__(self):
+        return self.numStates
+
+    def exportText(self, path):
+        writeTextQTable(path, self.values.tolist())
+
+    def flush(self):
+        "Rewrites the whole table to disc"
+        writeTextQTable(self.path, self.values.tolist())
+
+    def close(self):
+        self.flush()
+
+class MmapQTableStore(object):
+    """
+    A Q-table stored as float64 values in a memory-mapped binary file.
+
+    File layout (all integers little-endian):
+
+      bytes 0-3     magic "QTAB"
+      bytes 4-5     format version
+      bytes 6-7     header size (offset of the first value)
+      bytes 8-11    number of states (rows)
+      bytes 12-15   number of actions (columns)
+      header size.. numStates * numActions float64 values, row-major
+    """
+    SNAPSHOT_FORMAT = "dense"
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, headerSize, numStates, numActions = QTABLE_HEADER.unpack_from(self.map, 0)
+        if magic != QTABLE_MAGIC:
+            raise Exception("Not a binary Q-table: " + path)
+        if version != QTABLE_VERSION:
+            raise Exception("Unsupported Q-table version %d in %s" % (version, path))
+        if len(self.map) < headerSize + numStates * numActions * QTABLE_DTYPE.itemsize:
+            raise Exception("Truncated Q-table: " + path)
+        self.numStates = numStates
+        self.numActions = numActions
+        self.values = np.frombuffer(self.map, dtype=QTABLE_DTYPE, count=numStates * numActions,
+                                    offset=headerSize).reshape(numStates, numActions)
+
+    def create(path, numStates, numActions, rows=None):
+        "Writes a new binary Q-table, zero-filled unless rows are given"
+        if rows is None:
+            rows = np.zeros((numStates, numActions))
+        writeBinaryQTable(path, np.reshape(rows, (numStates, numActions)))
+    create = staticmethod(create)
+
+    def fromText(textPath, path):
+        "Imports a text Q-table into a new binary Q-table"
+        rows = readTextQTable(textPath)
+        numActions = len(rows[0]) if rows else 0
+        MmapQTableStore.create(path, len(rows), numActions, rows)
+    fromText = staticmethod(fromText)
+
+    def __getitem__(self, row):
+        return self.values[row]
+
+    def getRow(self, code):
+        return code
+
+    def snapshot(self):
+        return [self.values.copy()]
+
+    def fitsSnapshot(self, shape):
+        return tuple(shape) == self.values.shape
+
+    def restore(self, path):
+        self.values[:] = loadSnapshot(self, path)[0]
+
+    def __len__(self):
+        return self.numStates
+
+    def exportText(self, path):
+        writeTextQTable(path, self.values.tolist())
+
+    def flush(self):
+        "Writes the dirty pages back to disc"
+        self.map.flush()
+
+    def close(self):
+        if self.map.closed: return
+        self.flush()
+        self.values = None
+        try:
+            self.map.close()
+        except BufferError:
+            # Some views of the table are still alive; the map goes with them
+            pass
+        self.file.close()
+
+HASHED_EXTENSION = ".qhash"
+# Slots of a HashedQTableStore index that hold no row
+HASHED_EMPTY = -1
+HASHED_DELETED = -2
+
+class HashedQTableStore(object):
+    """
+    A sparse Q-table for large state encodings.  A state is identified by a
+    non-negative integer code (e.g. several features packed together) and
+    only gets a row when it is first visited, through getRow(code).
+
+    The rows live in store.values, a (maxStates x actions) array whose pages
+    the OS only backs once they are written.  An open-addressing index,
+    linear probing over a power-of-two array of row numbers at most half
+    full, maps codes to rows.  A row keeps its number for as long as its
+    state stays in the table.
+
+    Once all maxStates rows are taken, eviction='lru' drops the least
+    recently used states and eviction='lfu' the least visited ones, a
+    sixteenth of the table at a time; without eviction a full table raises
+    an exception.  States used in the last few lookups are never evicted,
+    but rows remembered for longer (e.g. by a replay buffer) may come to
+    hold another state.  memoryUsage() reports the bytes taken by the live
+    states and the index.
+
+    The table is saved as a snapshot of its live states (see
+    writeSnapshotFile), so it can be opened again as a hashed table only.
+    """
+    EVICTION_POLICIES = (None, "lru", "lfu")
+    # Lookups during which a row is safe from eviction
+    RECENT_LOOKUPS = 8
+
+    SNAPSHOT_FORMAT = "hashed"
+    # The arrays of a snapshot, values first
+    SNAPSHOT_ARRAYS = ("values", "codes", "visits", "lastUsed")
+
+    def __init__(self, path, numActions=5, maxStates=65536, eviction=None):
+        if eviction not in HashedQTableStore.EVICTION_POLICIES:
+            raise Exception("Unknown eviction policy %s" % eviction)
+        self.path = path
+        self.eviction = eviction
+        saved = None
+        if os.path.exists(path):
+            format, shape, saved = readSnapshotFile(path)
+            if format != HashedQTableStore.SNAPSHOT_FORMAT:
+                raise Exception("%s is a %s snapshot, not a hashed Q-table" % (path, format))
+            numActions = shape[1]
+            maxStates = max(int(maxStates), shape[0])
+        self.numActions = int(numActions)
+        self.maxStates = int(maxStates)
+        self.values = np.zeros((self.maxStates, self.numActions), dtype=QTABLE_DTYPE)
+        self.codes = np.full(self.maxStates, -1, dtype=np.int64)
+        self.visits = np.zeros(self.maxStates, dtype=np.int64)
+        self.lastUsed = np.zeros(self.maxStates, dtype=np.int64)
+        self.clock = 0
+        indexSize = 1
+        while indexSize < 2 * self.maxStates:
+            indexSize *= 2
+        self.index = np.full(indexSize, HASHED_EMPTY, dtype=np.int64)
+        self.indexShift = 64 - (indexSize.bit_length() - 1)
+        self.numDeleted = 0
+        self.freeRows = list(range(self.maxStates - 1, -1, -1))
+        self.numStates = 0
+        if saved is not None:
+            self.load(saved)
+
+    def slotOf(self, code):
+        "Start of the probe sequence of a code (Fibonacci hashing)"
+        return ((code * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> self.indexShift
+
+    def findRow(self, code):
+        "The row of a code, or None if the state is not in the table"
+        index, codes, mask = self.index, self.codes, len(self.index) - 1
+        slot = self.slotOf(code)
+        while True:
+            row = index[slot]
+            if row == HASHED_EMPTY:
+                return None
+            if row >= 0 and codes[row] == code:
+                return int(row)
+            slot = (slot + 1) & mask
+
+    def getRow(self, code):
+        "The row of a code, created (zero-filled) on the state's first visit"
+        row = self.findRow(code)
+        if row is None:
+            row = self.insert(code)
+        self.visits[row] += 1
+        self.lastUsed[row] = self.clock
+        self.clock += 1
+        return row
+
+    def insert(self, code):
+        if not self.freeRows:
+            if self.eviction is None:
+                raise Exception("Hashed Q-table %s is full (%d states)" % (self.path, self.maxStates))
+            self.evict(max(1, self.maxStates // 16))
+        row = self.freeRows.pop()
+        self.codes[row] = code
+        self.values[row] = 0.0
+        self.visits[row] = 0
+        self.addToIndex(code, row)
+        self.numStates += 1
+        return row
+
+    def addToIndex(self, code, row):
+        index, mask = self.index, len(self.index) - 1
+        slot = self.slotOf(code)
+        while index[slot] >= 0:
+            slot = (slot + 1) & mask
+        if index[slot] == HASHED_DELETED:
+            self.numDeleted -= 1
+        index[slot] = row
+
+    def evict(self, count):
+        "Drops the count least recently used (or least visited) states"
+        live = np.flatnonzero(self.codes >= 0)
+        live = live[self.lastUsed[live] < self.clock - HashedQTableStore.RECENT_LOOKUPS]
+        count = min(count, len(live))
+        if count == 0:
+            raise Exception("Hashed Q-table %s is too small to evict from" % self.path)
+        if self.eviction == "lru":
+            keys = self.lastUsed[live]
+        else:
+            # Least visited first, the least recently used among equals
+            keys = self.visits[live] * (self.clock + 1) + self.lastUsed[live]
+        victims = live[np.argpartition(keys, count - 1)[:count]]
+        for row in victims:
+            self.removeFromIndex(int(self.codes[row]), row)
+            self.codes[row] = -1
+            self.freeRows.append(int(row))
+        self.numStates -= count
+        if self.numDeleted > len(self.index) // 4:
+            self.rebuildIndex()
+
+    def removeFromIndex(self, code, row):
+        index, mask = self.index, len(self.index) - 1
+        slot = self.slotOf(code)
+        while index[slot] != row:
+            slot = (slot + 1) & mask
+        index[slot] = HASHED_DELETED
+        self.numDeleted += 1
+
+    def rebuildIndex(self):
+        "Reinserts every state, clearing the deleted slots"
+        self.index[:] = HASHED_EMPTY
+        self.numDeleted = 0
+        for row in np.flatnonzero(self.codes >= 0):
+            self.addToIndex(int(self.codes[row]), int(row))
+
+    def memoryUsage(self):
+        "Bytes taken by the live states (values and bookkeeping) and the index"
+        rowBytes = self.values.itemsize * self.numActions + self.codes.itemsize + \
+                   self.visits.itemsize + self.lastUsed.itemsize
+        return self.numStates * rowBytes + self.index.nbytes
+
+    def __getitem__(self, row):
+        return self.values[row]
+
+    def __len__(self):
+        return self.numStates
+
+    def snapshot(self):
+        "The live states, as the arrays of SNAPSHOT_ARRAYS"
+        live = np.flatnonzero(self.codes >= 0)
+        return [self.values[live], self.codes[live], self.visits[live], self.lastUsed[live]]
+
+    def fitsSnapshot(self, shape):
+        return shape[0] <= self.maxStates and shape[1] == self.numActions
+
+    def load(self, arrays):
+        "Replaces the states in the table by those of a snapshot"
+        values, codes, visits, lastUsed = arrays
+        if not self.fitsSnapshot(values.shape):
+            raise Exception("Snapshot does not fit the Q-table %s" % self.path)
+        self.codes[:] = -1
+        count = len(codes)
+        self.codes[:count] = codes
+        self.values[:count] = values
+        self.visits[:count] = visits
+        self.lastUsed[:count] = lastUsed
+        self.clock = int(self.lastUsed[:count].max()) + 1 if count else 0
+        self.freeRows = list(range(self.maxStates - 1, count - 1, -1))
+        self.numStates = count
+        self.rebuildIndex()
+
+    def restore(self, path):
+        self.load(loadSnapshot(self, path))
+
+    def exportText(self, path):
+        "Writes the live states as text rows, each starting with the state code"
+        live = np.flatnonzero(self.codes >= 0)
+        writeTextQTable(path, [[int(self.codes[row])] + self.values[row].tolist() for row in live])
+
+    def flush(self):
+        "Rewrites the live states to disc"
+        writeSnapshotFile(self.path, HashedQTableStore.SNAPSHOT_FORMAT, self.snapshot())
+
+    def close(self):
+        self.flush()
+
+def openQTable(path, **hashedOptions):
+    """
+    Opens the Q-table at path.  Files ending in .txt use the text backend,
+    .qhash files the hashed one (with the given HashedQTableStore options)
+    and anything else the binary one.  A missing binary table is imported
+    from the text table with the same base name.
+    """
+    if path.endswith(".txt"):
+        return TextQTableStore(path)
+    if path.endswith(HASHED_EXTENSION):
+        return HashedQTableStore(path, **hashedOptions)
+    if not os.path.exists(path):
+        MmapQTableStore.fromText(os.path.splitext(path)[0] + ".txt", path)
+    return MmapQTableStore(path)
+
+class QTableCheckpointer(object):
+    """
+    Periodically snapshots the values of a Q-table store into a checkpoint
+    directory.  The snapshot is copied on the caller's thread (the table is
+    small) and written by a background thread, so the game loop never waits
+    on the disc.  If a write is still in progress when the next snapshot is
+    taken, only the newest pending snapshot is kept.
+
+    Checkpoints are snapshot files (see writeSnapshotFile) named
+    qtable-<sequence>.ckpt; the sequence keeps growing across runs and only
+    the newest `keep` files are kept.  Each table has its own directory,
+    <table path>.checkpoints unless another one is given.
+
+    Once the table has been closed cleanly, markClean() writes the sequence
+    of the newest checkpoint to a CLEAN_NAME file in the directory, so that
+    resume() only considers the checkpoints taken after it.
+    """
+    PREFIX = "qtable-"
+    SUFFIX = ".ckpt"
+    DIRECTORY_SUFFIX = ".checkpoints"
+    CLEAN_NAME = "clean"
+
+    def __init__(self, store, directory=None, everyEpisodes=100, everySeconds=60.0, keep=3):
+        self.store = store
+        if directory is None:
+            directory = store.path + QTableCheckpointer.DIRECTORY_SUFFIX
+        self.directory = directory
+        self.everyEpisodes = int(everyEpisodes)
+        self.everySeconds = float(everySeconds)
+        self.keep = max(1, int(keep))
+
+        latest = QTableCheckpointer.latest(directory)
+        self.sequence = latest[0] if latest else 0
+        self.lastEpisode = 0
+        self.lastTime = time.time()
+
+        self.pending = None
+        self.closing = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def isEnabled(self):
+        return self.everyEpisodes > 0 or self.everySeconds > 0
+
+    def listCheckpoints(directory):
+        "Returns the (sequence, path) pairs of the checkpoints in directory, oldest first"
+        if not os.path.isdir(directory): return []
+        checkpoints = []
+        for name in os.listdir(directory):
+            prefix, suffix = QTableCheckpointer.PREFIX, QTableCheckpointer.SUFFIX
+            if name.startswith(prefix) and name.endswith(suffix):
+                sequence = name[len(prefix):-len(suffix)]
+                if sequence.isdigit():
+                    checkpoints.append((int(sequence), os.path.join(directory, name)))
+        return sorted(checkpoints)
+    listCheckpoints = staticmethod(listCheckpoints)
+
+    def latest(directory):
+        "Returns the (sequence, path) of the newest checkpoint, or None"
+        checkpoints = QTableCheckpointer.listCheckpoints(directory)
+        return checkpoints[-1] if checkpoints else None
+    latest = staticmethod(latest)
+
+    def cleanSequence(directory):
+        "The sequence of the newest checkpoint when the table was last closed cleanly, or 0"
+        try:
+            with open(os.path.join(directory, QTableCheckpointer.CLEAN_NAME), "r") as cleanFile:
+                return int(cleanFile.read().strip() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+    cleanSequence = staticmethod(cleanSequence)
+
+    def markClean(self):
+        """
+        Records that the table was saved after all the checkpoints so far.
+        Call it once the store has been closed.
+        """
+        if not os.path.isdir(self.directory): return
+        def write(cleanFile):
+            cleanFile.write("%d\n" % self.sequence)
+        replaceFile(os.path.join(self.directory, QTableCheckpointer.CLEAN_NAME), write)
+
+    def resume(self):
+        """
+        Loads the newest checkpoint into the store if it was taken after the
+        table was last closed cleanly, as happens after a crash.
+        Checkpoints of another format or shape are skipped with a warning.
+        Returns the path of the checkpoint loaded, or None.
+        """
+        clean = QTableCheckpointer.cleanSequence(self.directory)
+        for sequence, path in reversed(QTableCheckpointer.listCheckpoints(self.directory)):
+            if sequence <= clean:
+                return None
+            try:
+                self.store.restore(path)
+                return path
+            except Exception as e:
+                print('Skipping checkpoint %s: %s' % (path, e), file=sys.stderr)
+        return None
+
+    def maybeCheckpoint(self, episode):
+        "Takes a checkpoint if enough episodes or seconds have gone by"
+        if (self.everyEpisodes > 0 and episode - self.lastEpisode >= self.everyEpisodes) or \
+           (self.everySeconds > 0 and time.time() - self.lastTime >= self.everySeconds):
+            self.checkpoint(episode)
+
+    def checkpoint(self, episode):
+        "Snapshots the store and hands it to the writer thread"
+        self.lastEpisode = episode
+        self.lastTime = time.time()
+        snapshot = (self.store.SNAPSHOT_FORMAT, self.store.snapshot())
+        with self.condition:
+            self.pending = snapshot
+            self.condition.notify()
+        if self.thread is None:
+            self.closing = False
+            self.thread = threading.Thread(target=self._writeCheckpoints, name="QTableCheckpointer")
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def _writeCheckpoints(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closing:
+                    self.condition.wait()
+                if self.pending is None: return
+                snapshot, self.pending = self.pending, None
+            self._write(snapshot)
+
+    def _write(self, snapshot):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.sequence += 1
+        name = "%s%09d%s" % (QTableCheckpointer.PREFIX, self.sequence, QTableCheckpointer.SUFFIX)
+        format, arrays = snapshot
+        writeSnapshotFile(os.path.join(self.directory, name), format, arrays)
+        for sequence, path in QTableCheckpointer.listCheckpoints(self.directory)[:-self.keep]:
+            os.remove(path)
+
+    def close(self, timeout=10.0):
+        "Waits for the pending snapshot to be written and stops the writer thread"
+        if self.thread is None: return
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.thread = None
+        atexit.unregister(self.close)
@@ -0,0 +1,126 @@
+# replayBuffer.py
+# ---------------
+
+"""
+Experience replay for the tabular Q-learning agents.
+
+A ReplayBuffer keeps the last `capacity` transitions in fixed-width NumPy
+arrays used as a ring buffer.  A transition is stored by its Q-table
+coordinates:
+
+  row, column - the qtable row of the state and the column of the action
+  reward      - the reward received
+  nextRow     - the qtable row of the next state, or -1 if it is terminal
+  nextMask    - the legal columns of the next state
+
+so that a minibatch of TD updates is a handful of array operations over
+the Q-table (see QLearningAgent.replayTransitions).  With priority > 0, transitions
+are sampled in proportion to |TD error| ** priority through a SumTree
+instead of uniformly.
+"""
+
+import numpy as np
+
+class SumTree(object):
+    """
+    A binary tree over `capacity` non-negative leaves where every node holds
+    the sum of its children, so that the leaves can be sampled in proportion
+    to their values in O(log capacity).  Updates and draws are batched: each
+    level of the tree is handled for all the indices at once.
+    """
+    def __init__(self, capacity):
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.tree = np.zeros(2 * self.size)
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, values):
+        "Sets the leaves at the given indices to the given values"
+        nodes = np.asarray(indices) + self.size
+        self.tree[nodes] = values
+        # All the leaves are at the same depth, so the nodes move up in step;
+        # a parent listed twice just gets the same sum twice
+        level = self.size // 2
+        while level >= 1:
+            nodes = nodes // 2
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            level //= 2
+
+    def set(self, index, value):
+        "Sets a single leaf"
+        node = index + self.size
+        tree = self.tree
+        tree[node] = value
+        node //= 2
+        while node >= 1:
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+            node //= 2
+
+    def find(self, targets):
+        "The leaf index at each cumulative value in targets"
+        targets = np.array(targets, dtype=float)
+        nodes = np.ones(len(targets), dtype=np.intp)
+        while nodes[0] < self.size:
+            left = 2 * nodes
+            leftSums = self.tree[left]
+            goLeft = targets < leftSums
+            targets = np.where(goLeft, targets, targets - leftSums)
+            nodes = np.where(goLeft, left, left + 1)
+        return nodes - self.size
+
+class ReplayBuffer(object):
+    "The last `capacity` transitions, in arrays used as a ring buffer"
+
+    def __init__(self, capacity, numActions, priority=0.0, minPriority=1e-3):
+        self.capacity = capacity
+        self.rows = np.zeros(capacity, dtype=np.intp)
+        self.columns = np.zeros(capacity, dtype=np.intp)
+        self.rewards = np.zeros(capacity)
+        self.nextRows = np.zeros(capacity, dtype=np.intp)
+        self.nextMasks = np.zeros((capacity, numActions), dtype=bool)
+        self.next = 0
+        self.count = 0
+        self.priority = priority
+        self.minPriority = minPriority
+        self.tree = SumTree(capacity) if priority > 0 else None
+        self.maxPriority = 1.0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, row, column, reward, nextRow, nextMask):
+        "Stores a transition, overwriting the oldest once the buffer is full"
+        i = self.next
+        self.rows[i] = row
+        self.columns[i] = column
+        self.rewards[i] = reward
+        if nextRow is None:
+            self.nextRows[i] = -1
+            self.nextMasks[i] = False
+        else:
+            self.nextRows[i] = nextRow
+            self.nextMasks[i] = nextMask
+        if self.tree is not None:
+            # New transitions are replayed at least once before their error is known
+            self.tree.set(i, self.maxPriority)
+        self.next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def sample(self, batchSize, rng):
+        "The indices of a minibatch of transitions"
+        if self.tree is None:
+            return rng.integers(0, self.count, batchSize)
+        # One draw in each of batchSize equal slices of the total priority
+        total = self.tree.total()
+        targets = (np.arange(batchSize) + rng.random(batchSize)) * (total / batchSize)
+        return np.minimum(self.tree.find(targets), self.count - 1)
+
+    def updatePriorities(self, indices, errors):
+        "Sets the priorities of replayed transitions from their TD errors"
+        if self.tree is None: return
+        priorities = (np.abs(errors) + self.minPriority) ** self.priority
+        self.tree.update(indices, priorities)
+        self.maxPriority = max(self.maxPriority, priorities.max())
@@ -0,0 +1,8 @@
+# conftest.py
+# -----------
+
+import os, sys
+
+# The modules live at the top of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,12 @@
+# test_bustersAgents.py
+# ---------------------
+
+import bustersAgents
+import ghostAgents
+
+def test_num_particles_only_reaches_particle_filters():
+    ghosts = [ghostAgents.RandomGhost(1)]
+    exact = bustersAgents.BustersAgent(inference='ExactInference', ghostAgents=ghosts, numParticles=50)
+    assert not hasattr(exact.inferenceModules[0], 'numParticles')
+    particles = bustersAgents.BustersAgent(inference='ParticleFilter', ghostAgents=ghosts, numParticles=50)
+    assert particles.inferenceModules[0].numParticles == 50
@@ -0,0 +1,58 @@
+# test_bustersEnv.py
+# ------------------
+
+import random
+
+import numpy as np
+
+import bustersEnv
+import ghostAgents
+import layout
+from conftest import ROOT
+
+def makeEnv(numEnvs, maxMoves):
+    random.seed(0)
+    board = layout.getLayout(ROOT + '/labyrinths/labAA2.lay')
+    ghosts = [ghostAgents.RandomGhost(i + 1) for i in range(board.getNumGhosts())]
+    return bustersEnv.VecBustersEnv(board, ghosts, numEnvs, maxMoves)
+
+def test_games_restart_once_they_are_over():
+    env = makeEnv(4, 10)
+    numGhosts = len(env.ghostAgents)
+    observations = env.reset()
+    assert observations.shape == (4, 2 + 4 * numGhosts)
+    initial = env.newState().getPacmanPosition()
+    rng = np.random.default_rng(0)
+    finished = np.zeros(4, dtype=int)
+    for step in range(35):
+        masks = env.legalMasks()
+        actions = [rng.choice(np.flatnonzero(mask)) for mask in masks]
+        observations, rewards, dones = env.step(actions)
+        assert observations.shape == (4, 2 + 4 * numGhosts)
+        assert rewards.shape == dones.shape == (4,)
+        for i in range(4):
+            if dones[i]:
+                final = env.finalStates[i]
+                assert final.isWin() or final.isLose()
+                # The game went on in a fresh state straight away
+                assert env.states[i].numMoves == 0 and env.states[i].getScore() == 0
+                assert tuple(observations[i, :2]) == initial
+            else:
+                assert env.finalStates[i] is None
+        finished += dones
+    # Every game ends within maxMoves rounds, and restarts
+    assert (finished >= 3).all()
+    assert env.episodes == finished.sum()
+
+def test_step_takes_direction_names_and_checks_the_number_of_actions():
+    env = makeEnv(2, 10)
+    env.reset()
+    legal = [env.states[i].getLegalActions(0)[0] for i in range(2)]
+    observations, rewards, dones = env.step(legal)
+    assert observations.shape[0] == 2
+    try:
+        env.step(legal[:1])
+    except Exception as e:
+        assert "Expected 2 actions" in str(e)
+    else:
+        assert False, "no exception"
@@ -0,0 +1,62 @@
+# test_game.py
+# ------------
+
+import layout
+import pacman
+from game import Directions, GameStateData, Grid
+from conftest import ROOT
+
+def getInitialState():
+    state = pacman.GameState()
+    state.initialize(layout.getLayout(ROOT + '/layouts/mediumClassic.lay'), 2)
+    return state
+
+def test_writes_after_a_childs_copy_do_not_reach_the_grandparent():
+    grandparent = getInitialState().data
+    parent = GameStateData(grandparent)
+    child = GameStateData(parent)
+    child.getWritableAgentState(0).scaredTimer = 1
+    # The child copied its AgentState; the parent still shares its own
+    parent.getWritableAgentState(0).scaredTimer = 2
+    assert grandparent.agentStates[0].scaredTimer == 0
+    assert child.agentStates[0].scaredTimer == 1
+
+def test_sibling_successors_are_independent():
+    state = getInitialState()
+    start = state.getPacmanPosition()
+    legal = [a for a in state.getLegalActions(0) if a != Directions.STOP]
+    first = state.generateSuccessor(0, legal[0])
+    second = state.generateSuccessor(0, legal[1])
+    assert first.getPacmanPosition() != second.getPacmanPosition()
+    assert state.getPacmanPosition() == start
+
+def test_move_history_packs_moves_in_chunks():
+    from game import MoveHistory, MOVE_ACTIONS
+    moves = [(i % 3, MOVE_ACTIONS[i % len(MOVE_ACTIONS)]) for i in range(MoveHistory.CHUNK_MOVES + 10)]
+    history = MoveHistory()
+    for move in moves:
+        history.append(move)
+    assert len(history.chunks) == 1 and history.pending == 10
+    assert len(history) == len(moves)
+    assert list(history) == moves
+    assert [history[i] for i in range(len(moves))] == moves
+    history.flush()
+    assert len(history.chunks) == 2 and list(history) == moves
+    assert history[MoveHistory.CHUNK_MOVES + 3] == moves[-7] and history[-1] == moves[-1]
+    assert history[2:5] == moves[2:5]
+    try:
+        history[len(moves)]
+    except IndexError:
+        pass
+    else:
+        assert False, "no IndexError"
+
+def test_grid_columns_are_built_on_demand_and_follow_writes():
+    grid = Grid(5, 3)
+    grid[4][1] = True
+    assert list(grid._columns) == [4]
+    copy = grid.copy()
+    assert copy[-1][1] and list(copy._columns) == [4]
+    copy.set(4, 2, True)
+    assert copy[4][2] and copy[-1] is copy[4]
+    assert not grid[4][2] and grid.count() == 1
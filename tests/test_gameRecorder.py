@@ -0,0 +1,55 @@
+# test_gameRecorder.py
+# --------------------
+
+import random
+
+import game
+import gameRecorder
+import ghostAgents
+import layout
+import pacman
+import pacmanAgents
+import textDisplay
+from conftest import ROOT
+
+def recordGame(path, monkeypatch):
+    monkeypatch.setattr(game.MoveHistory, 'CHUNK_MOVES', 16)
+    random.seed(0)
+    board = layout.getLayout(ROOT + '/layouts/smallClassic.lay')
+    ghosts = [ghostAgents.RandomGhost(i + 1) for i in range(board.getNumGhosts())]
+    rules = pacman.ClassicGameRules()
+    rules.quiet = True
+    played = rules.newGame(board, pacmanAgents.GreedyAgent(), ghosts, textDisplay.NullGraphics(), True)
+    recorder = gameRecorder.GameRecorder(str(path), board)
+    played.moveHistory = gameRecorder.MoveHistory(recorder, played)
+    played.run()
+    recorder.close()
+    return played
+
+def replayState(recording, stop, start=0, stateData=None):
+    state = pacman.GameState()
+    if stateData is None:
+        state.initialize(recording.layout, recording.layout.getNumGhosts())
+    else:
+        state.data = stateData
+    for move in recording.iterMoves(start, stop):
+        state = state.generateSuccessor(*move)
+    return state
+
+def test_moves_round_trip(tmp_path, monkeypatch):
+    played = recordGame(tmp_path / 'game.rec', monkeypatch)
+    recording = gameRecorder.GameRecording(str(tmp_path / 'game.rec'))
+    assert len(recording) == len(played.moveHistory) > 3 * 16
+    assert recording.getMoves() == list(played.moveHistory)
+    assert recording.getMoves(20, 40) == list(played.moveHistory)[20:40]
+    assert replayState(recording, None).data == played.state.data
+
+def test_seeking_plays_on_from_the_nearest_snapshot(tmp_path, monkeypatch):
+    recordGame(tmp_path / 'game.rec', monkeypatch)
+    recording = gameRecorder.GameRecording(str(tmp_path / 'game.rec'))
+    assert recording.getSnapshot(15) == (0, None)
+    for move in (16, 40, len(recording) - 1):
+        snapshotMove, stateData = recording.getSnapshot(move)
+        assert snapshotMove == move // 16 * 16
+        seeked = replayState(recording, move, snapshotMove, stateData)
+        assert seeked.data == replayState(recording, move).data
@@ -0,0 +1,106 @@
+# test_inference.py
+# -----------------
+
+import random
+import pytest
+import busters
+import bustersGhostAgents
+import ghostAgents
+import inference
+import layout
+import util
+from conftest import ROOT
+
+GHOST_CLASSES = [ghostAgents.RandomGhost, ghostAgents.StaticGhost, ghostAgents.DirectionalGhost,
+                 bustersGhostAgents.StationaryGhost, bustersGhostAgents.DispersingGhost]
+
+def playStates(ghostClass, numMoves=12, seed=0):
+    "The states of a short random game on a two-ghost maze"
+    random.seed(seed)
+    lay = layout.getLayout(ROOT + '/labyrinths/labAA2.lay')
+    ghosts = [ghostClass(i + 1) for i in range(lay.getNumGhosts())]
+    state = busters.GameState()
+    state.initialize(lay, len(ghosts))
+    states = [state]
+    for move in range(numMoves):
+        for index in range(state.getNumAgents()):
+            if state.isWin() or state.isLose(): return states, ghosts
+            if index == 0:
+                action = random.choice(state.getLegalPacmanActions())
+            else:
+                action = ghosts[index - 1].getAction(state)
+            state = state.generateSuccessor(index, action)
+        states.append(state)
+    return states, ghosts
+
+def elapseTime(module, beliefs, gameState):
+    "The forward update of the beliefs one position at a time, as the unvectorised module did"
+    newBeliefs = util.Counter()
+    for oldPos, prob in beliefs.items():
+        state = module.setGhostPosition(gameState.deepCopy(), oldPos)
+        for newPos, moveProb in module.getPositionDistribution(state).items():
+            if newPos in module.legalPositions:
+                newBeliefs[newPos] += moveProb * prob
+    newBeliefs.normalize()
+    return newBeliefs
+
+@pytest.mark.parametrize("ghostClass", GHOST_CLASSES)
+def test_exact_elapse_matches_the_per_position_update(ghostClass):
+    states, ghosts = playStates(ghostClass)
+    for ghost in ghosts:
+        module = inference.ExactInference(ghost)
+        module.initialize(states[0])
+        beliefs = util.Counter(module.getBeliefDistribution())
+        for state in states[1:]:
+            module.elapseTime(state)
+            beliefs = elapseTime(module, beliefs, state)
+            vectorised = module.getBeliefDistribution()
+            for position in module.legalPositions:
+                assert abs(vectorised[position] - beliefs[position]) < 1e-9
+
+def assertFrequencies(ids, positions, expected):
+    "Checks that the particles at the given ids follow the expected position distribution"
+    expected = dict((p, prob) for p, prob in expected.items() if p in positions)
+    total = sum(expected.values())
+    for position in set(expected) | set(positions[id] for id in ids):
+        frequency = (ids == positions.index(position)).mean()
+        assert abs(frequency - expected.get(position, 0) / total) < 0.03
+
+@pytest.mark.parametrize("ghostClass", GHOST_CLASSES)
+def test_particle_elapse_follows_the_ghost_distribution(ghostClass):
+    states, ghosts = playStates(ghostClass, numMoves=1)
+    state = states[-1]
+    module = inference.ParticleFilter(ghosts[0], numParticles=20000)
+    module.initialize(state)
+    start = module.legalPositions[len(module.legalPositions) // 2]
+    module.particles[:] = module.legalPositions.index(start)
+    module.elapseTime(state)
+    placed = module.setGhostPosition(state.deepCopy(), start)
+    assertFrequencies(module.particles, module.legalPositions, module.getPositionDistribution(placed))
+
+@pytest.mark.parametrize("ghostClass", GHOST_CLASSES)
+def test_joint_elapse_moves_each_ghost_given_its_particle(ghostClass):
+    states, ghosts = playStates(ghostClass, numMoves=1)
+    state = states[-1]
+    legalPositions = [p for p in state.getWalls().asList(False) if p[1] > 1]
+    jointFilter = inference.JointParticleFilter(numParticles=20000)
+    jointFilter.initialize(state, legalPositions)
+    for ghost in ghosts:
+        jointFilter.addGhostAgent(ghost)
+
+    # Half the particles in each of two joint positions, the ghosts of the
+    # first close together and those of the second far apart
+    first, second = legalPositions[0], legalPositions[len(legalPositions) // 2]
+    near = min(legalPositions[1:], key=lambda p: util.manhattanDistance(p, first))
+    rows = [[0, legalPositions.index(near)], [0, legalPositions.index(second)]]
+    jointFilter.particles[:10000] = rows[0]
+    jointFilter.particles[10000:] = rows[1]
+    jointFilter.elapseTime(state)
+
+    for half, row in enumerate(rows):
+        particles = jointFilter.particles[half * 10000:(half + 1) * 10000]
+        positions = [legalPositions[id] for id in row]
+        for i, ghost in enumerate(ghosts):
+            placed = inference.setGhostPositions(state.deepCopy(), positions)
+            expected = inference.getPositionDistributionForGhost(placed, i, ghost)
+            assertFrequencies(particles[:, i], legalPositions, expected)
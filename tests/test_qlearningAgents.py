@@ -0,0 +1,27 @@
+# test_qlearningAgents.py
+# -----------------------
+
+import os
+
+import ghostAgents
+import qlearningAgents
+
+def test_approximate_agent_checkpoints_next_to_its_weights(tmp_path):
+    weights = str(tmp_path / "weights.txt")
+    agent = qlearningAgents.ApproximateQAgent(ghostAgents=[ghostAgents.RandomGhost(1)], weights=weights)
+    try:
+        assert agent.checkpointer.directory == weights + ".checkpoints"
+        assert not agent.getWeights().any()
+    finally:
+        agent.close()
+    assert os.path.exists(weights)
+
+def test_approximate_agent_rejects_experience_replay(tmp_path):
+    weights = str(tmp_path / "weights.txt")
+    try:
+        qlearningAgents.ApproximateQAgent(ghostAgents=[ghostAgents.RandomGhost(1)], weights=weights, replaySize="100")
+    except Exception as e:
+        assert "replay" in str(e)
+    else:
+        assert False, "no exception"
+    assert not os.path.exists(weights)
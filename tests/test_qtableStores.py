@@ -0,0 +1,166 @@
+# test_qtableStores.py
+# --------------------
+
+import os
+import numpy as np
+import qtableStores
+
+def makeTextTable(path, numStates, numActions):
+    qtableStores.writeTextQTable(str(path), [[0.0] * numActions for i in range(numStates)])
+    return qtableStores.openQTable(str(path))
+
+def checkpointNow(store, directory=None):
+    checkpointer = qtableStores.QTableCheckpointer(store, directory)
+    checkpointer.checkpoint(1)
+    checkpointer.close()
+    return qtableStores.QTableCheckpointer.latest(checkpointer.directory)[1]
+
+def test_text_and_binary_round_trip(tmp_path):
+    store = makeTextTable(tmp_path / "q.txt", 6, 5)
+    store[3][2] = 1.5
+    store.close()
+    assert qtableStores.openQTable(str(tmp_path / "q.txt"))[3][2] == 1.5
+
+    binary = qtableStores.openQTable(str(tmp_path / "q.bin"))
+    assert binary.values.shape == (6, 5) and binary[3][2] == 1.5
+    binary[0][0] = -2.0
+    binary.close()
+    assert qtableStores.openQTable(str(tmp_path / "q.bin"))[0][0] == -2.0
+
+def test_checkpoints_are_kept_next_to_their_table(tmp_path):
+    store = makeTextTable(tmp_path / "q.txt", 6, 5)
+    path = checkpointNow(store)
+    assert os.path.dirname(path) == str(tmp_path / "q.txt.checkpoints")
+
+def test_resume_restores_a_newer_checkpoint(tmp_path):
+    store = makeTextTable(tmp_path / "q.txt", 6, 5)
+    store[2][1] = 7.0
+    path = checkpointNow(store)
+
+    reopened = qtableStores.openQTable(store.path)
+    assert reopened[2][1] == 0.0
+    assert qtableStores.QTableCheckpointer(reopened).resume() == path
+    assert reopened[2][1] == 7.0
+
+def test_resume_ignores_checkpoints_older_than_a_clean_close(tmp_path):
+    qtableStores.writeTextQTable(str(tmp_path / "q.txt"), [[0.0] * 5] * 6)
+    store = qtableStores.openQTable(str(tmp_path / "q.bin"))
+    checkpointer = qtableStores.QTableCheckpointer(store)
+    store[2][1] = 1.0
+    checkpointer.checkpoint(1)
+    store[2][1] = 2.0
+    checkpointer.close()
+    # Closing the map does not touch the file's mtime
+    store.close()
+    checkpointer.markClean()
+
+    reopened = qtableStores.openQTable(store.path)
+    assert qtableStores.QTableCheckpointer(reopened).resume() is None
+    assert reopened[2][1] == 2.0
+
+    # Checkpoints taken after the clean close still count after a crash
+    checkpointer = qtableStores.QTableCheckpointer(reopened)
+    reopened[2][1] = 3.0
+    checkpointer.checkpoint(2)
+    checkpointer.close()
+    reopened[2][1] = 0.0
+    assert qtableStores.QTableCheckpointer(reopened).resume() is not None
+    assert reopened[2][1] == 3.0
+
+def test_resume_skips_checkpoints_of_another_shape(tmp_path, capsys):
+    small = makeTextTable(tmp_path / "small.txt", 6, 5)
+    directory = str(tmp_path / "shared")
+    path = checkpointNow(small, directory)
+    large = makeTextTable(tmp_path / "large.txt", 12, 5)
+
+    assert qtableStores.QTableCheckpointer(large, directory).resume() is None
+    assert "Skipping checkpoint" in capsys.readouterr().err
+    assert not large.values.any()
+
+def test_resume_skips_checkpoints_of_another_format(tmp_path, capsys):
+    dense = makeTextTable(tmp_path / "q.txt", 6, 5)
+    directory = str(tmp_path / "shared")
+    path = checkpointNow(dense, directory)
+    hashed = qtableStores.openQTable(str(tmp_path / "q.qhash"))
+
+    assert qtableStores.QTableCheckpointer(hashed, directory).resume() is None
+    assert "Skipping checkpoint" in capsys.readouterr().err
+    assert len(hashed) == 0
+
+def test_snapshot_header(tmp_path):
+    path = str(tmp_path / "snapshot")
+    values = np.arange(10.0).reshape(2, 5)
+    qtableStores.writeSnapshotFile(path, "dense", [values])
+    format, shape, arrays = qtableStores.readSnapshotFile(path)
+    assert (format, shape) == ("dense", (2, 5))
+    assert np.array_equal(arrays[0], values)
+
+def test_failed_writes_leave_no_temporary_file(tmp_path):
+    path = str(tmp_path / "q.txt")
+    def write(tableFile):
+        tableFile.write("1.0 ")
+        raise IOError("disc full")
+    try:
+        qtableStores.replaceFile(path, write)
+    except IOError:
+        pass
+    assert os.listdir(str(tmp_path)) == []
+
+def test_hashed_round_trip(tmp_path):
+    path = str(tmp_path / "q.qhash")
+    store = qtableStores.openQTable(path, numActions=4, maxStates=8)
+    for code in (10 ** 12, 3, 77):
+        store[store.getRow(code)][1] = code / 2.0
+    store.close()
+
+    reopened = qtableStores.openQTable(path, maxStates=4)
+    assert len(reopened) == 3 and reopened.numActions == 4 and reopened.maxStates == 4
+    for code in (10 ** 12, 3, 77):
+        assert reopened[reopened.findRow(code)][1] == code / 2.0
+    assert reopened.findRow(4) is None
+
+def fillHashed(tmp_path, eviction, codes):
+    store = qtableStores.HashedQTableStore(str(tmp_path / "q.qhash"), 2, 32, eviction)
+    for code in codes:
+        store.getRow(code)
+    return store
+
+def test_hashed_lru_eviction_drops_the_least_recently_used(tmp_path):
+    store = fillHashed(tmp_path, "lru", list(range(32)) + list(range(2, 32)))
+    store.getRow(100)
+    # A sixteenth of the table, the two states not used since they were added
+    assert len(store) == 31
+    assert store.findRow(0) is None and store.findRow(1) is None
+    assert store.findRow(2) is not None and store.findRow(100) is not None
+
+def test_hashed_lfu_eviction_drops_the_least_visited(tmp_path):
+    store = fillHashed(tmp_path, "lfu", list(range(32)) + list(range(2, 11)) * 3 + [0, 1, 11] * 2)
+    store.getRow(100)
+    assert store.findRow(12) is None and store.findRow(13) is None
+    assert all(store.findRow(code) is not None for code in (0, 1, 11, 14, 100))
+
+def test_full_hashed_table_without_eviction_raises(tmp_path):
+    store = fillHashed(tmp_path, None, range(32))
+    try:
+        store.getRow(32)
+    except Exception as e:
+        assert "full" in str(e)
+    else:
+        assert False, "no exception"
+
+def test_hashed_store_rejects_dense_files(tmp_path):
+    path = str(tmp_path / "q.qhash")
+    qtableStores.writeSnapshotFile(path, "dense", [np.zeros((2, 5))])
+    try:
+        qtableStores.openQTable(path)
+    except Exception as e:
+        assert "not a hashed Q-table" in str(e)
+    else:
+        assert False, "no exception"
+    hashed = qtableStores.openQTable(str(tmp_path / "other.qhash"))
+    try:
+        hashed.restore(path)
+    except Exception as e:
+        assert "not a hashed one" in str(e)
+    else:
+        assert False, "no exception"
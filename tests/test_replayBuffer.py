@@ -0,0 +1,49 @@
+# test_replayBuffer.py
+# --------------------
+
+import numpy as np
+
+from replayBuffer import ReplayBuffer, SumTree
+
+def test_sum_tree_batched_and_single_updates_agree():
+    batched, single = SumTree(5), SumTree(5)
+    values = [1.0, 0.0, 2.0, 3.0, 4.0]
+    batched.update(np.arange(5), values)
+    for i, value in enumerate(values):
+        single.set(i, value)
+    assert np.allclose(batched.tree, single.tree)
+    assert batched.total() == 10.0
+
+def test_sum_tree_finds_the_leaf_at_each_cumulative_value():
+    tree = SumTree(4)
+    tree.update([0, 1, 2, 3], [1.0, 0.0, 2.0, 3.0])
+    # Leaves cover [0,1), [1,1), [1,3) and [3,6)
+    assert list(tree.find([0.0, 0.99, 1.0, 2.9, 3.0, 5.9])) == [0, 0, 2, 2, 3, 3]
+
+def test_buffer_overwrites_the_oldest_transition():
+    buffer = ReplayBuffer(3, 2)
+    for row in range(5):
+        buffer.add(row, row % 2, float(row), row + 1, [True, False])
+    buffer.add(5, 0, 5.0, None, None)
+    assert len(buffer) == 3
+    assert sorted(buffer.rows) == [3, 4, 5]
+    terminal = list(buffer.rows).index(5)
+    assert buffer.nextRows[terminal] == -1 and not buffer.nextMasks[terminal].any()
+
+def test_uniform_samples_stay_within_the_stored_transitions():
+    buffer = ReplayBuffer(8, 2)
+    for row in range(3):
+        buffer.add(row, 0, 0.0, None, None)
+    indices = buffer.sample(100, np.random.default_rng(0))
+    assert indices.min() >= 0 and indices.max() < 3
+
+def test_prioritised_samples_follow_the_td_errors():
+    buffer = ReplayBuffer(4, 2, priority=1.0, minPriority=0.0)
+    for row in range(4):
+        buffer.add(row, 0, 0.0, None, None)
+    buffer.updatePriorities(np.arange(4), np.array([0.0, 1.0, 0.0, -3.0]))
+    indices = buffer.sample(4000, np.random.default_rng(0))
+    counts = np.bincount(indices, minlength=4)
+    assert counts[0] == counts[2] == 0
+    assert abs(counts[3] / float(counts.sum()) - 0.75) < 0.01
+    assert buffer.maxPriority == 3.0
@@ -0,0 +1,39 @@
+# test_util.py
+# ------------
+
+import threading
+
+import util
+
+def callOffMainThread(function):
+    outcome = []
+    def run():
+        try:
+            outcome.append(function())
+        except Exception as e:
+            outcome.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    return outcome[0]
+
+def timedCall(function, timeout):
+    try:
+        return util.TimeoutFunction(function, timeout)()
+    except util.TimeoutFunctionException:
+        return 'timeout'
+
+def test_an_overrun_off_the_main_thread_does_not_block_later_calls():
+    release = threading.Event()
+    assert callOffMainThread(lambda: timedCall(release.wait, 0.05)) == 'timeout'
+    overrunning = [t for t in threading.enumerate() if t.name == 'TimeoutFunction']
+    assert overrunning and all(t.daemon for t in overrunning)
+    calls = [callOffMainThread(lambda: timedCall(lambda: 42, 1)) for _ in range(4)]
+    release.set()
+    assert calls == [42] * 4
+
+def test_exceptions_off_the_main_thread_reach_the_caller():
+    def fail():
+        raise ValueError('boom')
+    error = callOffMainThread(lambda: timedCall(fail, 1))
+    assert isinstance(error, ValueError)
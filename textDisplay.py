@@ -14,6 +14,9 @@ DISPLAY_MOVES = False
 QUIET = False # Supresses output
 
 class NullGraphics(object):
+    # Game.run skips the updates of null displays
+    NULL_DISPLAY = True
+
     def initialize(self, state, isBlue = False):
         pass
 
@@ -11,7 +11,9 @@ from past.utils import old_div
 from builtins import object
 import sys
 import inspect
-import heapq, random
+import types
+import heapq, random, bisect
+import numpy
 import io
 
 
@@ -271,11 +273,8 @@ class Counter(dict):
         """
         Returns the key with the highest value.
         """
-        if len(list(self.keys())) == 0: return None
-        all = list(self.items())
-        values = [x[1] for x in all]
-        maxIndex = values.index(max(values))
-        return all[maxIndex][0]
+        if len(self) == 0: return None
+        return max(self.items(), key=lambda item: item[1])[0]
 
     def sortedKeys(self):
         """
@@ -289,9 +288,7 @@ class Counter(dict):
         >>> a.sortedKeys()
         ['second', 'third', 'first']
         """
-        sortedItems = list(self.items())
-        compare = lambda x, y:  sign(y[1] - x[1])
-        sortedItems.sort(cmp=compare)
+        sortedItems = sorted(self.items(), key=lambda item: item[1], reverse=True)
         return [x[0] for x in sortedItems]
 
     def totalCount(self):
@@ -309,22 +306,20 @@ class Counter(dict):
         """
         total = float(self.totalCount())
         if total == 0: return
-        for key in list(self.keys()):
-            self[key] = old_div(self[key], total)
+        self.divideAll(total)
 
     def divideAll(self, divisor):
         """
         Divides all counts by divisor
         """
         divisor = float(divisor)
-        for key in self:
-            self[key] /= divisor
+        dict.update(self, [(key, value / divisor) for key, value in self.items()])
 
     def copy(self):
         """
         Returns a copy of the counter
         """
-        return Counter(dict.copy(self))
+        return type(self)(dict.copy(self))
 
     def __mul__(self, y ):
         """
@@ -384,7 +379,7 @@ class Counter(dict):
         >>> (a + b)['first']
         1
         """
-        addend = Counter()
+        addend = type(self)()
         for key in self:
             if key in y:
                 addend[key] = self[key] + y[key]
@@ -410,7 +405,7 @@ class Counter(dict):
         >>> (a - b)['first']
         -5
         """
-        addend = Counter()
+        addend = type(self)()
         for key in self:
             if key in y:
                 addend[key] = self[key] - y[key]
@@ -422,6 +417,28 @@ class Counter(dict):
             addend[key] = -1 * y[key]
         return addend
 
+class FastCounter(Counter):
+    """
+    A Counter whose missing keys read as 0 without being inserted, for the
+    hot numeric paths (beliefs, ghost action distributions, features).
+
+    >>> a = FastCounter()
+    >>> a['test']
+    0
+    >>> 'test' in a
+    False
+    >>> a['test'] += 1
+    >>> a['test']
+    1
+
+    Code that relies on reads adding keys (to list them later with keys()
+    or argMax) should keep using Counter.
+    """
+    __getitem__ = dict.__getitem__
+
+    def __missing__(self, key):
+        return 0
+
 def raiseNotDefined():
     fileName = inspect.stack()[1][1]
     line = inspect.stack()[1][2]
@@ -434,14 +451,12 @@ def normalize(vectorOrCounter):
     """
     normalize a vector or counter by dividing each value by the sum of all values
     """
-    normalizedCounter = Counter()
-    if type(vectorOrCounter) == type(normalizedCounter):
+    if isinstance(vectorOrCounter, Counter):
         counter = vectorOrCounter
         total = float(counter.totalCount())
         if total == 0: return counter
-        for key in list(counter.keys()):
-            value = counter[key]
-            normalizedCounter[key] = old_div(value, total)
+        normalizedCounter = counter.copy()
+        normalizedCounter.divideAll(total)
         return normalizedCounter
     else:
         vector = vectorOrCounter
@@ -449,39 +464,73 @@ def normalize(vectorOrCounter):
         if s == 0: return vector
         return [old_div(el, s) for el in vector]
 
+class Sampler(object):
+    """
+    Draws values from a fixed discrete distribution: the cumulative
+    probabilities are computed once and each draw is a binary search on
+    them, consuming a single random.random().  The probabilities need not
+    be normalized.
+    """
+    def __init__(self, distribution, values):
+        self.values = list(values)
+        self.cdf = []
+        total = 0.0
+        for prob in distribution:
+            total += prob
+            self.cdf.append(total)
+        if not self.cdf or total <= 0:
+            raise Exception('Cannot sample from a distribution without probability mass')
+        self.total = total
+
+    def draw(self):
+        i = bisect.bisect_left(self.cdf, random.random() * self.total)
+        return self.values[min(i, len(self.values) - 1)]
+
+    def drawMany(self, n):
+        "n draws at once, in the order of the values (as nSample returns them)"
+        rng = numpy.random.default_rng(random.getrandbits(64))
+        indices = numpy.searchsorted(self.cdf, rng.random(n) * self.total, side='left')
+        indices = numpy.minimum(numpy.sort(indices), len(self.values) - 1)
+        return [self.values[i] for i in indices]
+
+# Samplers of recently seen distributions, keyed by their (value, prob) items
+SAMPLER_CACHE_SIZE = 4096
+_samplers = {}
+
+def getSampler(distribution, values = None):
+    """
+    Returns a Sampler for a Counter (or dict) of probabilities, or for
+    parallel lists of probabilities and values.  Samplers are cached, as the
+    same few distributions (e.g. a ghost's options in a corridor) come up
+    over and over.
+    """
+    if isinstance(distribution, dict):
+        key = tuple(distribution.items())
+    else:
+        key = tuple(zip(values, distribution))
+    try:
+        sampler = _samplers.get(key)
+    except TypeError:
+        # Unhashable values cannot be cached
+        return Sampler([prob for value, prob in key], [value for value, prob in key])
+    if sampler is None:
+        if len(_samplers) >= SAMPLER_CACHE_SIZE:
+            _samplers.clear()
+        sampler = _samplers[key] = Sampler([prob for value, prob in key], [value for value, prob in key])
+    return sampler
+
 def nSample(distribution, values, n):
-    if sum(distribution) != 1:
-        distribution = normalize(distribution)
-    rand = [random.random() for i in range(n)]
-    rand.sort()
-    samples = []
-    samplePos, distPos, cdf = 0,0, distribution[0]
-    while samplePos < n:
-        if rand[samplePos] < cdf:
-            samplePos += 1
-            samples.append(values[distPos])
-        else:
-            distPos += 1
-            cdf += distribution[distPos]
-    return samples
+    """
+    Draws n samples in one vectorized call, returned in the order of the
+    values.
+    """
+    return getSampler(distribution, values).drawMany(n)
 
 def sample(distribution, values = None):
-    if type(distribution) == Counter:
-        items = list(distribution.items())
-        distribution = [i[1] for i in items]
-        values = [i[0] for i in items]
-    if sum(distribution) != 1:
-        distribution = normalize(distribution)
-    choice = random.random()
-    i, total= 0, distribution[0]
-    while choice > total:
-        i += 1
-        total += distribution[i]
-    return values[i]
+    return getSampler(distribution, values).draw()
 
 def sampleFromCounter(ctr):
-    items = list(ctr.items())
-    return sample([v for k,v in items], [k for k,v in items])
+    return sample(ctr)
 
 def getProbability(value, distribution, values):
     """
@@ -500,13 +549,9 @@ def flipCoin( p ):
 
 def chooseFromDistribution( distribution ):
     "Takes either a counter or a list of (prob, key) pairs and samples"
-    if type(distribution) == dict or type(distribution) == Counter:
+    if isinstance(distribution, dict):
         return sample(distribution)
-    r = random.random()
-    base = 0.0
-    for prob, element in distribution:
-        base += prob
-        if r <= base: return element
+    return sample([prob for prob, element in distribution], [element for prob, element in distribution])
 
 def nearestPoint( pos ):
     """
@@ -560,11 +605,14 @@ def lookup(name, namespace):
         module = __import__(moduleName)
         return getattr(module, objName)
     else:
-        modules = [obj for obj in list(namespace.values()) if str(type(obj)) == "<type 'module'>"]
+        modules = [obj for obj in list(namespace.values()) if isinstance(obj, types.ModuleType)]
         options = [getattr(module, name) for module in modules if name in dir(module)]
         options += [obj[1] for obj in list(namespace.items()) if obj[0] == name ]
+        # The same object may be reachable through several modules
+        options = [option for i, option in enumerate(options)
+                   if not any(option is other for other in options[:i])]
         if len(options) == 1: return options[0]
-        if len(options) > 1: raise Exception('Name conflict for %s')
+        if len(options) > 1: raise Exception('Name conflict for %s' % name)
         raise Exception('%s not found as a method or class' % name)
 
 def pause():
@@ -585,12 +633,25 @@ def pause():
 #
 import signal
 import time
+import threading
 class TimeoutFunctionException(Exception):
     """Exception to raise on a timeout"""
     pass
 
 
 class TimeoutFunction(object):
+    """
+    Calls a function with a time limit of timeout seconds (a float), raising
+    TimeoutFunctionException when it runs out.
+
+    On the main thread the call is interrupted by a SIGALRM interval timer.
+    On any other thread, or where there is no SIGALRM, the function runs on
+    a daemon thread of its own and the caller waits for it until the
+    deadline.  Threads cannot be interrupted, so a function that overruns
+    keeps running in the background, though nothing waits for it (not even
+    the interpreter at exit).  Either way several games can be timed at
+    once from different threads.
+    """
     def __init__(self, function, timeout):
         self.timeout = timeout
         self.function = function
@@ -599,27 +660,33 @@ class TimeoutFunction(object):
         raise TimeoutFunctionException()
 
     def __call__(self, *args, **keyArgs):
-        # If we have SIGALRM signal, use it to cause an exception if and
-        # when this function runs too long.  Otherwise check the time taken
-        # after the method has returned, and throw an exception then.
-        if hasattr(signal, 'SIGALRM'):
+        if self.timeout <= 0:
+            self.handle_timeout(None, None)
+        if hasattr(signal, 'SIGALRM') and threading.current_thread() is threading.main_thread():
             old = signal.signal(signal.SIGALRM, self.handle_timeout)
-            signal.alarm(self.timeout)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
             try:
-                result = self.function(*args, **keyArgs)
+                return self.function(*args, **keyArgs)
             finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
                 signal.signal(signal.SIGALRM, old)
-            signal.alarm(0)
-        else:
-            startTime = time.time()
-            result = self.function(*args, **keyArgs)
-            timeElapsed = time.time() - startTime
-            if timeElapsed >= self.timeout:
-                self.handle_timeout(None, None)
+        outcome = []
+        def run():
+            try:
+                outcome.append((True, self.function(*args, **keyArgs)))
+            except BaseException as e:
+                outcome.append((False, e))
+        thread = threading.Thread(target=run, name='TimeoutFunction')
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout)
+        if not outcome:
+            self.handle_timeout(None, None)
+        succeeded, result = outcome[0]
+        if not succeeded:
+            raise result
         return result
 
-
-
 _ORIGINAL_STDOUT = None
 _ORIGINAL_STDERR = None
 _MUTED = False